@@ -44,11 +44,36 @@ register_handler(VideoDragElementHandler()).to("div.video-material-wrapper", "di
 register_handler(AudioSelectionHandler()).to("div.audio-material-wrapper", "div.comp-scoop-reply-dropdown-selection-overflow")
 register_handler(VideoSelectionHandler()).to("div.video-material-wrapper", "div.comp-scoop-reply-dropdown-selection-overflow")
 
-def find_handler_by_driver(source: WebDriver) -> Optional[BaseHandler]:
+# 一次脚本调用返回每个选择器在页面中是否存在
+_PRESENCE_SCRIPT = "return arguments[0].map(selector => document.querySelector(selector) !== null);"
+
+
+def get_route_selectors() -> list[str]:
+    """
+    路由表中出现的所有选择器 (去重, 保持顺序)
+    """
+    selectors = []
     for registry in registered_handlers:
-        if all([find_element_safely(source, target) for target in registry.to_targets]) \
-                and not any([find_element_safely(source, target) for target in registry.not_to_targets]):
-            return registry.handler
+        selectors.extend(registry.to_targets)
+        selectors.extend(registry.not_to_targets)
+    return list(dict.fromkeys(selectors))
+
+
+def resolve_handler(presence: dict[str, bool]) -> Optional[BaseHandler]:
+    """
+    根据选择器是否存在, 按注册顺序匹配处理器
+    每次返回新的处理器实例, 多个浏览器并行答题时各自的任务状态互不影响
+    """
+    for registry in registered_handlers:
+        if all(presence[target] for target in registry.to_targets) \
+                and not any(presence[target] for target in registry.not_to_targets):
+            return type(registry.handler)()
 
     return None
 
+
+def find_handler_by_driver(source: WebDriver) -> Optional[BaseHandler]:
+    selectors = get_route_selectors()
+    presence = dict(zip(selectors, source.execute_script(_PRESENCE_SCRIPT, selectors)))
+    return resolve_handler(presence)
+
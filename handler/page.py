@@ -0,0 +1,154 @@
+import copy
+from functools import cached_property
+from typing import Optional
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup, NavigableString, Tag
+
+from handler.models import Choice
+
+# 一次脚本调用读取整个页面与当前地址
+_SNAPSHOT_SCRIPT = "return [document.documentElement.outerHTML, location.href];"
+
+
+class PageModel:
+    """
+    任务页面快照, 整个页面只读取一次并只解析一次
+    处理器从这里读取材料, 题目, 选项, 填空与提示, 页面元素只用于交互
+    """
+
+    def __init__(self, html: str, url: str = ''):
+        self.url = url
+        self.soup = BeautifulSoup(html, 'lxml')
+
+    def has(self, selector: str) -> bool:
+        return self.soup.select_one(selector) is not None
+
+    def count(self, selector: str) -> int:
+        return len(self.soup.select(selector))
+
+    def _media_url(self, selector: str) -> Optional[str]:
+        media = self.soup.select_one(selector)
+        if media is None:
+            return None
+        src = media.get('src')
+        if not src and (source := media.select_one('source[src]')):
+            src = source.get('src')
+        return urljoin(self.url, src) if src else None
+
+    @cached_property
+    def audio_url(self) -> Optional[str]:
+        return self._media_url("div.audio-material-wrapper>div>audio.unipus-audio-h5")
+
+    @cached_property
+    def video_url(self) -> Optional[str]:
+        return self._media_url("div.video-material-wrapper video")
+
+    @cached_property
+    def passage(self) -> str:
+        material = self.soup.select_one("div.text-material-wrapper")
+        return material.get_text(separator="\n") if material else ''
+
+    @cached_property
+    def tips(self) -> list[str]:
+        tip_list = []
+        tips = self.soup.select_one("div.word-tips-wrap")
+        if tips:
+            for branch in tips.select("div.qc-abs-word-branch"):
+                title = branch.select_one("h2.word-title").get_text()
+                word_list = []
+                for item in branch.select("li.word-item-container"):
+                    word_name = item.select_one("div.word-name").get_text()
+                    word_explanation = item.select_one("div.word-explanation").get_text()
+                    word_list.append(f"{word_name} {word_explanation}")
+                tip_list.append(f"{title}: {' '.join(word_list)}")
+        return tip_list
+
+    @cached_property
+    def choice_questions(self) -> list[dict]:
+        """
+        选择题, 每项为 {"title": 标题, "options": [选项], "multiple": 是否多选}
+        """
+        questions = []
+        for question in self.soup.select("div.question-common-abs-choice"):
+            question_options = []
+            for option in question.select("div.option"):
+                caption = option.select_one("div.caption").get_text()
+                content = option.select_one("div.content").get_text()
+                question_options.append(Choice(caption=caption, content=content).model_dump())
+            questions.append({
+                "title": question.select_one("div.ques-title").get_text(),
+                "options": question_options,
+                "multiple": "multipleChoice" in question.get("class", [])
+            })
+        return questions
+
+    @cached_property
+    def blank_paragraph(self) -> str:
+        """
+        填空文本, 空格处替换为 n)___
+        """
+        areas = self.soup.select('div[autodiv="already"]') or self.soup.select('div.comp-scoop-reply p')
+        text_area = ""
+        for area in areas:
+            paragraph = area if area.name == 'p' else area.find('p')
+            if paragraph is None:
+                continue
+            for child in paragraph.children:
+                if isinstance(child, NavigableString):
+                    text_area += child.text
+                else:
+                    child: Tag
+                    _class: list[str] = child.get("class")
+                    if not _class:
+                        continue
+                    index = int(child.get("data-scoop-index", "-1"))
+                    if "fe-scoop" in _class and index >= 0:
+                        text_area += f"{index + 1})___"
+        return text_area
+
+    @cached_property
+    def correction_text(self) -> str:
+        """
+        词汇纠正文本, 空格处替换为 ___
+        """
+        wrapper = self.soup.select_one("div.question-common-abs-scoop>div>div")
+        if wrapper is None:
+            return ''
+        wrapper = copy.copy(wrapper)
+        for span in wrapper.select("span.fe-scoop"):
+            span.replace_with('___')
+        return wrapper.get_text(separator="\n")
+
+    @cached_property
+    def inputbox_questions(self) -> list[str]:
+        return [question.select_one("div.question-inputbox-header").get_text()
+                for question in self.soup.select("div.question-inputbox")]
+
+    @cached_property
+    def selection_questions(self) -> list[dict]:
+        """
+        下拉选择题, 每项为 {"title": 题干, "options": [选项]}, 选项号从0开始
+        """
+        questions = []
+        for question in self.soup.select(
+                "div.comp-scoop-reply-dropdown-selection-overflow tbody>tr > *:nth-child(2)"):
+            direct_text = ''.join(child.text for child in question.children if isinstance(child, NavigableString))
+            ol = question.find("ol")
+            li_elements = ol.find_all("li") if ol else []
+            questions.append({
+                "title": direct_text,
+                "options": [Choice(caption=str(index), content=li.get_text()).model_dump()
+                            for index, li in enumerate(li_elements)]
+            })
+        return questions
+
+    @cached_property
+    def sortable_items(self) -> list[str]:
+        return [item.get_text(separator="\n")
+                for item in self.soup.select("div.sortable-list-wrapper>div#sequenceReplyViewItemText")]
+
+
+def take_snapshot(driver) -> PageModel:
+    html, url = driver.execute_script(_SNAPSHOT_SCRIPT)
+    return PageModel(html, url)
@@ -0,0 +1,41 @@
+# 提示词中题目, 选项与提示的统一紧凑格式, 不把 JSON 字符串或 Python 列表直接拼进提示词
+
+
+def compact(text: str) -> str:
+    """
+    合并多余的空白与换行
+    """
+    return ' '.join(str(text).split())
+
+
+def format_tips(tips: list[str]) -> str:
+    if not tips:
+        return "无"
+    return '\n'.join(f"- {compact(tip)}" for tip in tips)
+
+
+def format_numbered(items: list[str], start: int = 1) -> str:
+    """
+    按序号逐行列出, 如问题列表, 排序选项
+    """
+    if not items:
+        return "无"
+    return '\n'.join(f"{index}. {compact(item)}" for index, item in enumerate(items, start))
+
+
+def format_options(options: list[dict]) -> str:
+    return '\n'.join(f"   {compact(option['caption'])}. {compact(option['content'])}" for option in options)
+
+
+def format_questions(questions: list[dict]) -> str:
+    """
+    题目与选项, 题目为 {"title": 标题, "options": [{"caption": 选项号, "content": 选项内容}]}
+    """
+    if not questions:
+        return "无"
+    lines = []
+    for index, question in enumerate(questions, 1):
+        lines.append(f"{index}. {compact(question['title'])}")
+        if question['options']:
+            lines.append(format_options(question['options']))
+    return '\n'.join(lines)
@@ -2,7 +2,7 @@ import time
 from abc import abstractmethod, ABC
 from typing import Union
 
-from bs4 import BeautifulSoup, NavigableString, Tag
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate
 from selenium.common import TimeoutException
 from selenium.webdriver import ActionChains
@@ -12,49 +12,37 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.wait import WebDriverWait
 
 from handler.models import *
+from handler.page import PageModel, take_snapshot
+from handler.prompt import format_tips, format_questions, format_numbered
 from runner import driver
 from util import audio_parser, download
 from util.config import config
-from util.llm import llm
+from util.answer_store import answer_store, AnswerStore
+from util.llm import invoke_structured, route_profile, count_tokens, replay_items
 from util.log import logger
-from util.selenium import click_button, get_parent_element, find_element_safely, get_pure_text
+from util.metrics import prompt_tokens
+from util.tracing import tracer
+from util.selenium import click_button, get_pure_text, get_pure_texts, get_result_flags, \
+    wait_for_settled, find, find_all, find_text, fill_values
 
 
-def _parse_audio_text():
-    audio_field = driver.find_element(By.CSS_SELECTOR, "div.audio-material-wrapper>div>audio.unipus-audio-h5")
-    download_url = audio_field.get_attribute("src")
-    audio_file_path = download.download_file(download_url)
+def _parse_audio_text(page: PageModel):
+    if not page.audio_url:
+        raise ValueError("页面中没有找到音频")
+    audio_file_path = download.download_file(page.audio_url)
     text = audio_parser.from_audio(audio_file_path)
     return text
 
 
-def _parse_video_text():
-    video_field = driver.find_element(By.CSS_SELECTOR, "div.video-material-wrapper video")
-    download_url = video_field.get_attribute("src")
-    video_file_path = download.download_file(download_url)
+def _parse_video_text(page: PageModel):
+    if not page.video_url:
+        raise ValueError("页面中没有找到视频")
+    video_file_path = download.download_file(page.video_url)
     text = audio_parser.from_video(video_file_path)
     return text
 
 
-def _extract_tips() -> list[str]:
-    tips = find_element_safely(driver, "div.word-tips-wrap")
-    tip_list = []
-    if tips:
-        soup = BeautifulSoup(tips.get_attribute("outerHTML"), 'lxml')
-        branches = soup.select("div.qc-abs-word-branch")
-        tip_list = []
-        for branch in branches:
-            title = branch.select_one("h2.word-title").get_text()
-            items = branch.select("li.word-item-container")
-            word_list = []
-            for item in items:
-                word_name = item.select_one("div.word-name").get_text()
-                word_explanation = item.select_one("div.word-explanation").get_text()
-                word_list.append(f"{word_name} {word_explanation}")
-            tip_list.append(f"{title}: {' '.join(word_list)}")
-    return tip_list
-
-
+@tracer.traced("click.answer")
 def _click_button_with_answer(selector, wait_time=30) -> bool:
     from selenium.common import TimeoutException
     try:
@@ -71,27 +59,305 @@ def _click_button_with_answer(selector, wait_time=30) -> bool:
 
 
 class BaseHandler:
+    # 提交后判断每道题对错时使用的题目选择器, 为空则不支持只重做错题
+    _result_selector: Optional[str] = None
+    # 答案所在的数组字段, 与 _result_selector 选中的题目一一对应
+    _answer_field: Optional[str] = None
+    # 大模型输出结构, 为空则不能提前提问
+    _schema: Optional[type[BaseModel]] = None
+
     def __init__(self):
         self.retry = 0
         self.score = 0.0
-        self.retry_messages = ''
+        # 本次任务的页面快照与从中抓取的题目内容, 重试时沿用
+        self.snapshot: Optional[PageModel] = None
+        self.page: Optional[dict] = None
+        # 与大模型的对话记录, 重试时在此基础上追加一轮修正
+        self.messages: Optional[list] = None
+        self.response: Optional[BaseModel] = None
+        # 上一次提交中答错的题目: 答案字段 -> 序号
+        self.wrong_items: Optional[dict[str, list[int]]] = None
+        # 当前任务的位置 (图书, 页面, 栏目, 任务序号), 用于已验证答案库
+        self.task_key: Optional[tuple] = None
+        # 流水线中提前得到的答案, 首次作答时直接使用
+        self.prepared: Optional[BaseModel] = None
+
+    def reset(self, task_key: Optional[tuple] = None):
+        """
+        清空上一次任务留下的状态
+        :param task_key: 新任务的位置 (图书, 页面, 栏目, 任务序号)
+        """
+        self.task_key = task_key
+        self.retry = 0
+        self.score = 0.0
+        self.snapshot = None
+        self.page = None
+        self.messages = None
+        self.response = None
+        self.wrong_items = None
+        self.prepared = None
+
+    def prepare(self) -> Optional[BaseModel]:
+        """
+        流水线中提前提问, 需要已设置页面快照与任务位置; 已有验证过的答案或没有输出结构时返回 None
+        """
+        if self._schema is None:
+            return None
+        if self.page is None:
+            self.page = self._scrape()
+        if self._stored_answer(self._schema) is not None:
+            return None
+        return self._ask(self._schema)
+
+    def adopt(self, prepared: 'BaseHandler'):
+        """
+        沿用流水线中提前得到的对话与答案
+        """
+        if type(prepared) is not type(self) or prepared.response is None:
+            return
+        self.messages = prepared.messages
+        self.prepared = prepared.response
 
     @abstractmethod
     def _internal_handle(self) -> Union[None, str, list[str]]:
         pass
 
+    def _scrape(self) -> dict:
+        """
+        从页面快照中抓取作答需要的内容, 每个任务只执行一次
+        """
+        return {}
+
     def handle(self) -> bool:
         """
         执行操作
         :return: 大模型给出的答案
         """
+        if self.page is None:
+            self.snapshot = take_snapshot(driver)
+            self.page = self._scrape()
         answers = self._internal_handle()
-        time.sleep(1)
+        wait_for_settled(driver)
         return self._post_handle(answers)
 
     def _post_handle(self, answers) -> bool:
         return True
 
+    def _ask(self, schema, on_item=None):
+        """
+        在当前对话中提问, 首次提问时用子类的 _build_messages 根据抓取的页面内容构建消息
+        """
+        if self.messages is None:
+            self.messages = self._build_messages()
+        self.response = self._invoke(self.messages, schema, on_item)
+        return self.response
+
+    def _follow_up(self, content: str):
+        """
+        把上一次的答案与一轮修正提示追加到对话中, 下一次提问沿用同一对话
+        """
+        if self.messages is None or self.response is None:
+            return
+        self.messages = self.messages + [
+            AIMessage(content=self.response.model_dump_json()),
+            HumanMessage(content=content)
+        ]
+
+    def _invoke(self, messages, schema, on_item=None):
+        """
+        按 ai.routing 为本处理器与当前重试次数选择模型后调用大模型
+        """
+        profile = route_profile(type(self), self.retry)
+        tokens = count_tokens(messages, profile)
+        prompt_tokens.record(type(self).__name__, tokens)
+        logger.info(f"使用模型配置: {profile}, 提示词约{tokens} tokens")
+        # 流式输出的回调在大模型线程中执行, 需要沿用本线程绑定的浏览器填写页面
+        if on_item is not None:
+            on_item = driver.carry(on_item)
+        return invoke_structured(messages, schema, on_item=on_item, profile=profile)
+
+    @tracer.traced("fill.fields")
+    def _fill_fields(self, fields: list[WebElement], values: list[str], fallback):
+        """
+        一次脚本调用填写全部输入框并按返回的实际内容校验, 校验不通过的输入框逐个输入
+        :param fields: 输入框
+        :param values: 答案
+        :param fallback: 逐个输入的方法, 参数为 (输入框列表, 序号, 答案)
+        """
+        from selenium.common import WebDriverException
+        count = min(len(fields), len(values))
+        try:
+            written = fill_values(driver, fields[:count], values[:count])
+        except WebDriverException as e:
+            logger.warning(f"批量填写失败, 逐个输入: {e}")
+            written = [None] * count
+        for index in range(count):
+            if written[index] != str(values[index]):
+                logger.info(f"第{index + 1}处批量填写校验失败, 逐个输入")
+                fallback(fields, index, values[index])
+
+    def _stream_fill(self, fields: list[WebElement]):
+        """
+        流式输出时每解析出一个答案立即写入对应输入框, 否则返回 None, 全部答案给出后统一填写
+        """
+        if not config['ai'].get('streaming'):
+            return None
+
+        def fill(_, index, value):
+            if index < len(fields):
+                fill_values(driver, [fields[index]], [value])
+
+        return fill
+
+    def _requery(self, response, field: str, indices: list[int], reason: str, on_item=None) -> dict:
+        """
+        在当前对话后追加一轮, 只针对指定序号的题目重新提问
+        :param response: 大模型上一次的结构化输出
+        :param field: 答案所在的数组字段
+        :param indices: 需要重新作答的序号
+        :param reason: 追问原因
+        :param on_item: 元素回调, 回调的序号为原题目序号
+        :return: 序号 -> 新答案
+        """
+        numbers = ', '.join(str(index + 1) for index in indices)
+        followup = self.messages + [
+            AIMessage(content=response.model_dump_json()),
+            HumanMessage(content=f"{reason}, 请只按顺序返回 {field} 中第 {numbers} 项的答案, 其余项不要返回")
+        ]
+
+        def forward(item_field, index, item):
+            if on_item and item_field == field and index < len(indices):
+                on_item(item_field, indices[index], item)
+
+        extra = self._invoke(followup, type(response), on_item=forward)
+        return dict(zip(indices, getattr(extra, field) or []))
+
+    def _complete_answers(self, response, field: str, expected: int, on_item=None) -> list:
+        """
+        校验答案数量, 少于题目数量时只追问缺少的题目, 避免提交未作答完成的页面
+        :return: 补全后的答案列表
+        """
+        answers = list(getattr(response, field) or [])
+        if len(answers) < expected:
+            missing = list(range(len(answers), expected))
+            logger.warning(f"大模型给出{len(answers)}个答案, 题目共有{expected}个, 追问缺少的答案")
+            extra = self._requery(response, field, missing,
+                                  f"你只给出了{len(answers)}个答案, 但共有{expected}题", on_item)
+            # 按序号补齐, 遇到追问仍未给出的题目即停止, 避免后面的答案错位到前一题
+            for index in missing:
+                if index not in extra:
+                    break
+                answers.append(extra[index])
+            if len(answers) < expected:
+                logger.warning(f"追问后答案仍不足: {len(answers)}/{expected}")
+        setattr(response, field, answers)
+        return answers
+
+    def _answer(self, schema, expected: dict[str, int], on_item=None):
+        """
+        作答: 已知上次哪些题答错时只重答错题, 否则完整提问并补全缺少的答案
+        :param schema: 输出结构
+        :param expected: 答案字段 -> 题目数量
+        :param on_item: 元素回调
+        :return: 结构化输出
+        """
+        if self.retry == 0 and (stored := self._stored_answer(schema)) is not None:
+            logger.info("命中已验证答案, 跳过转录与大模型")
+            self.response = stored
+            if on_item:
+                replay_items(stored, on_item)
+            return stored
+
+        if self.retry == 0 and self.prepared is not None:
+            logger.info("使用流水线提前得到的答案")
+            response, self.prepared = self.prepared, None
+            self.response = response
+            self.wrong_items = None
+            if on_item:
+                replay_items(response, on_item)
+            for field, count in expected.items():
+                if count:
+                    self._complete_answers(response, field, count, on_item)
+            return response
+
+        if self.wrong_items and self.response is not None and self.messages is not None:
+            wrong_items, self.wrong_items = self.wrong_items, None
+            updates = {}
+            for field, indices in wrong_items.items():
+                logger.info(f"只重做答错的题目: {field} 第 {[index + 1 for index in indices]} 项")
+                updates[field] = self._requery(self.response, field, indices,
+                                               f"提交后正确率为{self.score}%, 这些项答错了, 不可重复之前的答案",
+                                               on_item)
+            for field, extra in updates.items():
+                answers = list(getattr(self.response, field) or [])
+                for index, item in extra.items():
+                    if index < len(answers):
+                        answers[index] = item
+                setattr(self.response, field, answers)
+            return self.response
+
+        self.wrong_items = None
+        response = self._ask(schema, on_item)
+        for field, count in expected.items():
+            if count:
+                self._complete_answers(response, field, count, on_item)
+        return response
+
+    def _store_key(self) -> Optional[str]:
+        if answer_store is None or self.task_key is None or self.page is None:
+            return None
+        return AnswerStore.make_key(self.task_key, self.page)
+
+    def _stored_answer(self, schema) -> Optional[BaseModel]:
+        key = self._store_key()
+        answer = answer_store.get(key) if key else None
+        if answer is None:
+            return None
+        try:
+            return schema.model_validate(answer)
+        except ValueError as e:
+            logger.warning(f"已验证答案无法解析, 重新作答: {e}")
+            return None
+
+    def _save_answer(self):
+        """
+        分数达标后保存答案
+        """
+        key = self._store_key()
+        if key and self.response is not None:
+            answer_store.put(key, type(self.response).__name__, self.response.model_dump(), self.score)
+
+    def _wrong_items(self, flags: list[Optional[bool]]) -> dict[str, list[int]]:
+        """
+        把页面中每道题的对错对应到答案字段中的序号
+        """
+        if not self._answer_field:
+            return {}
+        return {self._answer_field: [index for index, flag in enumerate(flags) if flag is False]}
+
+    def _answers_kept(self) -> bool:
+        """
+        重做页面是否保留了上一次的答案, 只重答错题时依赖这一点
+        默认重做时重新填写全部答案, 不依赖页面保留
+        """
+        return True
+
+    def _parse_wrong_items(self) -> Optional[dict[str, list[int]]]:
+        """
+        读取提交后的逐题结果, 无法判断每道题对错时返回 None
+        """
+        if not self._result_selector or self.response is None:
+            return None
+        try:
+            flags = get_result_flags(driver, self._result_selector)
+        except Exception as e:
+            logger.debug(f"读取逐题结果失败: {e}")
+            return None
+        if not flags or any(flag is None for flag in flags):
+            return None
+        wrong_items = {field: indices for field, indices in self._wrong_items(flags).items() if indices}
+        return wrong_items or None
+
     def _check_score_with_retry(self, answer) -> bool:
         try:
             score_element = WebDriverWait(driver, 2).until(
@@ -100,16 +366,27 @@ class BaseHandler:
             self.score = float(score_element.text)
             if self.score < 60.0:
                 raise TimeoutException("Error")
+            self._save_answer()
             return True
         except TimeoutException:
             if self.retry < 2:
                 logger.info("正确率低于60%, 返回重做")
+                wrong_items = self._parse_wrong_items()
                 click_button(driver, "button.ant-btn.ant-btn-primary span", 1)
                 if not _click_button_with_answer("div.question-common-course-page>a.btn"):
                     return True
                 click_button(driver, "button.ant-btn.ant-btn-primary span", 1)
                 self.retry += 1
-                self.retry_messages += f"错误答案: {answer}"
+                if wrong_items:
+                    wait_for_settled(driver)
+                if wrong_items and not self._answers_kept():
+                    logger.info("重做页面没有保留上一次的答案, 重新完整作答")
+                    wrong_items = None
+                if wrong_items:
+                    self.wrong_items = wrong_items
+                else:
+                    self._follow_up(f"提交后正确率为{self.score}%, 低于60%, 以上答案有错误, "
+                                    f"请修正后按相同格式重新返回全部答案, 不可完全重复之前的答案")
                 return self.handle()
             else:
                 logger.info("正确率低于60%, 重试三次失败")
@@ -125,9 +402,10 @@ class DiscussionHandler(BaseHandler):
                 EC.presence_of_all_elements_located((By.CSS_SELECTOR, 'div.discussion-cloud-recordList-item'))
             )
             if len(others) >= 5:
-                others_contents = [other.find_element(By.CSS_SELECTOR, "div.middle>.content").text for other in others]
-                discussion_title = driver.find_element(By.CSS_SELECTOR, 'div.discussion-title>p').text
-                discussion_content = get_pure_text(driver.find_element(By.CSS_SELECTOR, 'div.component-htmlview'))
+                others_contents = [find_text(other, "div.middle>.content", timeout=2) for other in others]
+                discussion_title = find_text(driver, 'div.discussion-title>p', timeout=2)
+                content_element = find(driver, 'div.component-htmlview', timeout=2)
+                discussion_content = get_pure_text(content_element) if content_element is not None else ""
                 prompt = ChatPromptTemplate.from_template(
                     """
                     以下是讨论的话题与别人的讨论内容, 主要根据别人的讨论内容生成一个"平均"的讨论内容，即综合一下, 词汇数要比其他人的讨论内容更少，最好在15-30词之间
@@ -135,20 +413,21 @@ class DiscussionHandler(BaseHandler):
                     {topic}
                     话题内容:
                     {content}
-                    讨论内容(列表格式):
+                    讨论内容:
                     {other_discussions}
                     """
                 )
-                chain = prompt | llm.with_structured_output(DiscussionAnswer)
-                response = chain.invoke(
-                    {
-                        'topic': discussion_title,
-                        'content': discussion_content,
-                        'other_discussions': others_contents
-                    }
+                messages = prompt.format_messages(
+                    topic=discussion_title,
+                    content=discussion_content,
+                    other_discussions=format_numbered(others_contents)
                 )
+                response = self._invoke(messages, DiscussionAnswer)
                 answer = response.answer
-                input_field = driver.find_element(By.CSS_SELECTOR, 'textarea.ant-input')
+                input_field = find(driver, 'textarea.ant-input', timeout=5)
+                if input_field is None:
+                    logger.info("没有找到讨论输入框")
+                    return None
                 input_field.clear()
                 input_field.send_keys(answer)
                 logger.info(f"输入评论: {answer}")
@@ -162,170 +441,263 @@ class DiscussionHandler(BaseHandler):
             logger.info("跳过不重要话题 (参与人数少于5)")
             return None
 
+# 选择题作答: 按选项标签找到目标并点击, 多选题根据当前选择状态只点击需要切换的选项
+# 页面中能读出选择状态时以页面为准, 否则使用传入的上次选择, 返回每道题最终的选择 (无法判断时为 null)
+_SELECT_CHOICES_SCRIPT = """
+const [targets, marks] = arguments;
+const wraps = document.querySelectorAll('div.option-wrap');
+const isSelected = node => node.matches('[aria-checked="true"], [aria-selected="true"]') ||
+    node.querySelector('input:checked') !== null ||
+    Array.from(node.classList).some(name => {
+        name = name.toLowerCase();
+        return marks.some(mark => name === mark || name.endsWith('-' + mark) || name.endsWith('_' + mark));
+    });
+if (targets === null) {
+    // 只读取每道题当前选中的选项, 无法判断选择状态时为 null
+    return Array.from(wraps).map(wrap => {
+        const options = Array.from(wrap.querySelectorAll('div.caption'));
+        const selected = options.filter(caption => isSelected(caption.parentElement))
+            .map(caption => caption.innerText.trim());
+        return selected.length ? selected : null;
+    });
+}
+return targets.map(target => {
+    const wrap = wraps[target.position];
+    if (!wrap) return {matched: false, expected: [], selected: null};
+    const options = Array.from(wrap.querySelectorAll('div.caption'))
+        .map(caption => ({caption: caption.innerText.trim(), node: caption.parentElement}));
+    let expected = options.filter(option => target.captions.includes(option.caption)).map(option => option.caption);
+    const matched = expected.length > 0;
+    if (!matched && options.length) expected = [options[0].caption];
+    if (!target.multiple) expected = expected.slice(0, 1);
+    const current = options.filter(option => isSelected(option.node)).map(option => option.caption);
+    const known = current.length ? current : target.previous;
+    for (const option of options) {
+        const want = expected.includes(option.caption);
+        const have = known.includes(option.caption);
+        if (target.multiple ? want !== have : want && !have) option.node.click();
+    }
+    const selected = options.filter(option => isSelected(option.node)).map(option => option.caption);
+    return {matched, expected, selected: selected.length ? selected : null};
+});
+"""
+
+
 class GeneralChoiceHandler(BaseHandler):
+    _result_selector = "div.question-common-abs-choice"
+    _schema = ChoiceAnswer
+
     @abstractmethod
     def _get_plain_text(self) -> str:
         pass
 
-    def _internal_handle(self) -> list[str]:
-        tip_list = _extract_tips()
-        questions = driver.find_elements(By.CSS_SELECTOR, "div.question-common-abs-choice")
+    def _scrape(self) -> dict:
         multiple_questions_list = []
         single_questions_list = []
-        for index, question in enumerate(questions):
-            question_soup = BeautifulSoup(question.get_attribute("outerHTML"), 'lxml')
-            question_title = question_soup.select_one("div.ques-title").get_text()
-            question_options = []
-            for option in question_soup.select("div.option"):
-                caption = option.select_one("div.caption").get_text()
-                content = option.select_one("div.content").get_text()
-                question_options.append(Choice(caption=caption, content=content).model_dump_json())
-            if "multipleChoice" in question.get_attribute("class").split(" "):
+        # 单选/多选题在页面中的位置, 用于把答案对应到 option-wrap
+        question_positions = {'single_choices': [], 'multiple_choices': []}
+        for index, question in enumerate(self.snapshot.choice_questions):
+            if question['multiple']:
+                question_positions['multiple_choices'].append(index)
                 multiple_questions_list.append(
                     {
-                        "title": question_title,
-                        "options": question_options
+                        "title": question['title'],
+                        "options": question['options']
                     }
                 )
             else:
+                question_positions['single_choices'].append(index)
                 single_questions_list.append(
                     {
-                        "title": question_title,
-                        "options": question_options
+                        "title": question['title'],
+                        "options": question['options']
                     }
                 )
+        return {
+            'tips': self.snapshot.tips,
+            'single_questions': single_questions_list,
+            'multiple_questions': multiple_questions_list,
+            'question_positions': question_positions
+        }
+
+    def _build_messages(self) -> list:
         prompt = ChatPromptTemplate.from_template(
             """
             你将要通过一些内容与提示推断出最符合问题的答案, 答案以问题的顺序按列表返回
-            其他提示通常为错误的答案提示，不可完全重复了
             内容:
             {content}
-            提示(列表): 
+            提示:
             {tips}
-            单选问题(列表):
+            单选问题:
             {single_questions}
-            多选问题(列表):
+            多选问题:
             {multiple_questions}
-            其他提示: {retry_message}
             """
         )
-        chain = prompt | llm.with_structured_output(ChoiceAnswer)
-
-        response = chain.invoke(
-            {
-                'content': self._get_plain_text(),
-                'tips': tip_list,
-                'single_questions': single_questions_list,
-                'multiple_questions': multiple_questions_list,
-                'retry_message': self.retry_messages
-            }
+        return prompt.format_messages(
+            content=self._get_plain_text(),
+            tips=format_tips(self.page['tips']),
+            single_questions=format_questions(self.page['single_questions']),
+            multiple_questions=format_questions(self.page['multiple_questions'])
         )
+
+    def _wrong_items(self, flags: list[Optional[bool]]) -> dict[str, list[int]]:
+        return {
+            field: [index for index, position in enumerate(positions)
+                    if position < len(flags) and flags[position] is False]
+            for field, positions in self.page['question_positions'].items()
+        }
+
+    def _read_selected(self) -> dict[int, list[str]]:
+        """
+        读取页面中每道题当前选中的选项, 无法判断选择状态的题目不包含在内
+        """
+        marks = config['unipus'].get('selected_classes', ['selected', 'checked', 'active'])
+        states = driver.execute_script(_SELECT_CHOICES_SCRIPT, None, [mark.lower() for mark in marks])
+        return {position: captions for position, captions in enumerate(states) if captions is not None}
+
+    def _answers_kept(self) -> bool:
+        if self.response is None:
+            return False
+        selected = self._read_selected()
+        for field, positions in self.page['question_positions'].items():
+            for index, choice in enumerate(getattr(self.response, field) or []):
+                if index < len(positions) and \
+                        sorted(selected.get(positions[index], [])) != sorted(self._choice_captions(field, choice)):
+                    return False
+        return True
+
+    def _internal_handle(self) -> list[str]:
+        question_positions = self.page['question_positions']
+        # 页面中每道题当前选中的选项, 只重做错题时从页面读取, 已是目标选择的题目不再点击
+        selected: dict[int, list[str]] = self._read_selected() if self.wrong_items else {}
+
+        def select_choice(field: str, index: int, choice: dict):
+            self._select_choices({field: {index: choice}}, selected)
+
+        expected = {field: len(positions) for field, positions in question_positions.items()}
+        on_item = select_choice if config['ai'].get('streaming') else None
+        response = self._answer(self._schema, expected, on_item=on_item)
+        self._select_choices({field: dict(enumerate(getattr(response, field) or []))
+                              for field in question_positions}, selected)
         valid_choices = None
-        single_choices = response.single_choices
-        multiple_choices = response.multiple_choices
-        if single_choices:
-            valid_choices = single_choices
-            for index, choice in enumerate(single_choices):
-                option_wrap = driver.find_elements(By.CSS_SELECTOR, "div.option-wrap")[index]
-                caption = choice.caption
-                select_divs = [get_parent_element(driver, element) for element in
-                               option_wrap.find_elements(By.CSS_SELECTOR, "div.caption")
-                               if
-                               element.text == caption]
-                logger.info(f"单选题{index + 1}选择答案: {caption}")
-                if len(select_divs) > 0:
-                    select_div = select_divs[0]
-                    select_div.click()
-                else:
-                    logger.info("警告: 大模型返回了错误的答案")
-                    get_parent_element(driver,
-                                       option_wrap.find_elements(By.CSS_SELECTOR, "div.caption")[0]).click()
-        if multiple_choices:
-            valid_choices = multiple_choices
-            for index, choice in enumerate(multiple_choices):
-                option_wrap = driver.find_elements(By.CSS_SELECTOR, "div.option-wrap")[index]
-                captions = choice.captions
-                select_divs = [get_parent_element(driver, element) for element in
-                               option_wrap.find_elements(By.CSS_SELECTOR, "div.caption")
-                               if
-                               element.text in captions]
-                for select_div in select_divs:
-                    select_div.click()
-                logger.info(f"多选题{index + 1}选择答案: {' '.join(captions)}")
-                if len(select_divs) == 0:
-                    logger.info("警告: 大模型返回了错误的答案")
-                    get_parent_element(driver,
-                                       option_wrap.find_elements(By.CSS_SELECTOR, "div.caption")[0]).click()
+        if response.single_choices:
+            valid_choices = response.single_choices
+        if response.multiple_choices:
+            valid_choices = response.multiple_choices
         click_button(driver, "div.question-common-course-page>a.btn")
         return valid_choices
 
+    @staticmethod
+    def _choice_captions(field: str, choice) -> list[str]:
+        if field == 'single_choices':
+            return [BaseSingleChoice.model_validate(choice).caption]
+        return BaseMultipleChoice.model_validate(choice).captions
+
+    @tracer.traced("fill.choices")
+    def _select_choices(self, choices: dict[str, dict[int, dict]], selected: dict[int, list[str]]):
+        """
+        一次脚本调用选择多道题的答案, 已是目标选择的题目跳过
+        :param choices: 答案字段 -> {题目序号: 答案}
+        :param selected: 题目位置 -> 当前选中的选项, 选择后更新
+        """
+        question_positions = self.page['question_positions']
+        targets = []
+        for field, items in choices.items():
+            positions = question_positions.get(field, [])
+            for index, choice in items.items():
+                if index >= len(positions):
+                    continue
+                captions = self._choice_captions(field, choice)
+                if sorted(selected.get(positions[index], [])) == sorted(captions):
+                    continue
+                if field == 'single_choices':
+                    logger.info(f"单选题{index + 1}选择答案: {captions[0]}")
+                else:
+                    logger.info(f"多选题{index + 1}选择答案: {' '.join(captions)}")
+                targets.append({
+                    'position': positions[index],
+                    'captions': captions,
+                    'previous': selected.get(positions[index], []),
+                    'multiple': field == 'multiple_choices'
+                })
+        if not targets:
+            return
+        marks = config['unipus'].get('selected_classes', ['selected', 'checked', 'active'])
+        results = driver.execute_script(_SELECT_CHOICES_SCRIPT, targets, [mark.lower() for mark in marks])
+        for target, result in zip(targets, results):
+            if not result['matched']:
+                logger.info("警告: 大模型返回了错误的答案")
+            if result['selected'] is None:
+                # 页面中无法判断选择状态, 按点击结果记录
+                selected[target['position']] = result['expected']
+            else:
+                selected[target['position']] = result['selected']
+                if sorted(result['selected']) != sorted(result['expected']):
+                    logger.warning(f"第{target['position'] + 1}题选择校验失败, "
+                                   f"期望: {result['expected']}, 实际: {result['selected']}")
+
 class GeneralBlankFillingHandler(BaseHandler, ABC):
-    def _fill_blanks(self, answers):
-        input_fields = driver.find_elements(By.CSS_SELECTOR, 'div.comp-scoop-reply input')
-        for index, answer in enumerate(answers):
-            logger.info(f"填词第{index + 1}处填写: {answer}")
-            if index > len(input_fields) - 1:
-                break
-            input_fields[index].clear()
-            input_fields[index].send_keys(answer)
+    _result_selector = "div.comp-scoop-reply input"
+    _answer_field = 'blanks'
+
+    @abstractmethod
+    def _build_messages(self) -> list:
+        pass
+
+    def _fill_blanks(self, input_fields: list[WebElement], answers: list[str]):
+        logger.info(f"填写{len(answers)}处: {answers}")
+        self._fill_fields(input_fields, answers, self._fill_blank)
+
+    @tracer.traced("fill.blank")
+    def _fill_blank(self, input_fields: list[WebElement], index: int, answer: str):
+        logger.info(f"填词第{index + 1}处填写: {answer}")
+        if index > len(input_fields) - 1:
+            return
+        input_fields[index].clear()
+        input_fields[index].send_keys(answer)
 
 class MediaBlankFillingHandler(GeneralBlankFillingHandler):
+    _schema = AudioWithBlankFillingAnswer
     @abstractmethod
     def _get_plain_text(self) -> str:
         pass
 
-    def _internal_handle(self) -> list[str]:
-        tip_list = _extract_tips()
-        areas: list[WebElement] = driver.find_elements(By.CSS_SELECTOR, 'div[autodiv="already"]')
-        if not areas:
-            areas: list[WebElement] = driver.find_elements(By.CSS_SELECTOR, 'div.comp-scoop-reply p')
-        text_area = ""
-        for area in areas:
-            soup = BeautifulSoup(area.get_attribute("outerHTML"), 'lxml')
-            for child in soup.p.children:
-                if isinstance(child, NavigableString):
-                    text_area += child.text
-                else:
-                    child: Tag
-                    _class: list[str] = child.get("class")
-                    if not _class:
-                        continue
-                    index = int(child.get("data-scoop-index", "-1"))
-                    if "fe-scoop" in _class and index >= 0:
-                        text_area += f"{index + 1})___"
-            #
-            # question_text = soup.get_text()
-            # text_with_blanks.append(question_text)
+    def _scrape(self) -> dict:
+        return {
+            'tips': self.snapshot.tips,
+            'paragraph': self.snapshot.blank_paragraph
+        }
+
+    def _build_messages(self) -> list:
         prompt = ChatPromptTemplate.from_template(
             """
             根据下列内容与提示推断 文本内n)处(如1), 2), 3))应填写什么正确的单词形式, 并按照顺序返回单词列表
-            其他提示通常为错误的答案提示，不可完全重复了
             内容:
             {content}
-            提示(列表): 
+            提示:
             {tips}
             文本:
             {paragraph}
-            其他提示: {retry_message}
             """
         )
-        chain = prompt | llm.with_structured_output(AudioWithBlankFillingAnswer)
-        response = chain.invoke(
-            {
-                'content': self._get_plain_text(),
-                'tips': tip_list,
-                'paragraph': text_area,
-                'retry_message': self.retry_messages,
-            }
+        return prompt.format_messages(
+            content=self._get_plain_text(),
+            tips=format_tips(self.page['tips']),
+            paragraph=self.page['paragraph']
         )
-        answers = response.blanks
-        super()._fill_blanks(answers)
+
+    def _internal_handle(self) -> list[str]:
+        input_fields = find_all(driver, 'div.comp-scoop-reply input', timeout=5)
+        answers = self._answer(self._schema, {'blanks': len(input_fields)},
+                               self._stream_fill(input_fields)).blanks
+        self._fill_blanks(input_fields, answers)
         click_button(driver, "div.question-common-course-page>a.btn")
         return answers
 
 class AudioWithBlankFillingHandler(MediaBlankFillingHandler):
     def _get_plain_text(self) -> str:
-        return _parse_audio_text()
+        return _parse_audio_text(self.snapshot)
 
     def _post_handle(self, answers) -> bool:
         if self._check_score_with_retry(answers):
@@ -337,7 +709,7 @@ class AudioWithBlankFillingHandler(MediaBlankFillingHandler):
 
 class AudioWithChoiceHandler(GeneralChoiceHandler):
     def _get_plain_text(self) -> str:
-        return _parse_audio_text()
+        return _parse_audio_text(self.snapshot)
 
     def _post_handle(self, answers) -> bool:
         if self._check_score_with_retry(answers):
@@ -348,93 +720,97 @@ class AudioWithChoiceHandler(GeneralChoiceHandler):
         return True
 
 class IdeaWithInputHandler(BaseHandler, ABC):
-    def _input_with_log(self, question_list, answers):
-        question_fields = driver.find_elements(By.CSS_SELECTOR, "textarea.question-inputbox-input")
-        for index, field in enumerate(question_fields):
-            logger.info(f"问题: {question_list[index]}, 回答: {answers[index]}")
-            field.clear()
-            field.send_keys(answers[index])
+    _schema = IdeaWithAudioOrVideoAnswer
+
+    @abstractmethod
+    def _build_messages(self) -> list:
+        pass
+
+    def _internal_handle(self) -> list[str]:
+        question_list = self.page['questions']
+        question_fields = find_all(driver, "textarea.question-inputbox-input", timeout=5)
+        answers = self._answer(self._schema, {'answers': len(question_fields)},
+                               self._stream_fill(question_fields)).answers
+        self._input_with_log(question_fields, question_list, answers)
+        click_button(driver, "div.question-common-course-page>a.btn")
+        return answers
+
+    def _input_with_log(self, question_fields: list[WebElement], question_list: list[str], answers: list[str]):
+        for question, answer in zip(question_list, answers):
+            logger.info(f"问题: {question}, 回答: {answer}")
+        self._fill_fields(question_fields, answers,
+                          lambda fields, index, answer: self._input_answer(fields, question_list, index, answer))
+
+    @tracer.traced("fill.input")
+    def _input_answer(self, question_fields: list[WebElement], question_list: list[str], index: int, answer: str):
+        if index > len(question_fields) - 1:
+            return
+        question_fields[index].clear()
+        question_fields[index].send_keys(answer)
 
 class IdeaWithAudioOrVideoHandler(IdeaWithInputHandler):
     def _post_handle(self, answers) -> bool:
         logger.info("完成本次观点答题")
         return True
 
-    def _internal_handle(self) -> list[str]:
-        tip_list = _extract_tips()
-        video = find_element_safely(driver, "div.video-material-wrapper")
-        if video:
-            content = _parse_video_text()
+    def _scrape(self) -> dict:
+        return {
+            'tips': self.snapshot.tips,
+            'video': self.snapshot.has("div.video-material-wrapper"),
+            'questions': self.snapshot.inputbox_questions
+        }
+
+    def _build_messages(self) -> list:
+        if self.page['video']:
+            content = _parse_video_text(self.snapshot)
         else:
-            content = _parse_audio_text()
-        questions = driver.find_elements(By.CSS_SELECTOR, "div.question-inputbox")
-        question_list = []
-        for question in questions:
-            question_soup = BeautifulSoup(question.get_attribute("outerHTML"), 'lxml')
-            question_title = question_soup.select_one("div.question-inputbox-header").get_text()
-            question_list.append(question_title)
+            content = _parse_audio_text(self.snapshot)
         prompt = ChatPromptTemplate.from_template(
             """
             你将要通过一些内容和提示推断出最符合问题的答案, 答案以问题的顺序按列表返回
             内容:
             {content}
-            提示(列表): 
+            提示:
             {tips}
-            问题(列表):
+            问题:
             {questions}
             """
         )
-        chain = prompt | llm.with_structured_output(IdeaWithAudioOrVideoAnswer)
-        response = chain.invoke(
-            {
-                'content': content,
-                'tips': tip_list,
-                'questions': question_list
-            }
+        return prompt.format_messages(
+            content=content,
+            tips=format_tips(self.page['tips']),
+            questions=format_numbered(self.page['questions'])
         )
-        answers = response.answers
-        super()._input_with_log(question_list, answers)
-        click_button(driver, "div.question-common-course-page>a.btn")
-        return answers
 
 class IdeaWithArticleHandler(IdeaWithInputHandler):
     def _post_handle(self, answers) -> bool:
         logger.info("完成本次观点答题")
         return True
 
-    def _internal_handle(self) -> list[str]:
-        text_soup = BeautifulSoup(
-            driver.find_element(By.CSS_SELECTOR, "div.text-material-wrapper").get_attribute("outerHTML"), 'lxml')
-        questions = driver.find_elements(By.CSS_SELECTOR, "div.question-inputbox")
-        question_list = []
-        for question in questions:
-            question_soup = BeautifulSoup(question.get_attribute("outerHTML"), 'lxml')
-            question_title = question_soup.select_one("div.question-inputbox-header").get_text()
-            question_list.append(question_title)
+    def _scrape(self) -> dict:
+        return {
+            'passage': self.snapshot.passage,
+            'questions': self.snapshot.inputbox_questions
+        }
+
+    def _build_messages(self) -> list:
         prompt = ChatPromptTemplate.from_template(
             """
             你将要通过文章推断出最符合问题的答案, 答案以问题的顺序按列表返回
             文章: 
             {passage}
-            问题(列表):
+            问题:
             {questions}
             """
         )
-        chain = prompt | llm.with_structured_output(IdeaWithAudioOrVideoAnswer)
-        response = chain.invoke(
-            {
-                'passage': text_soup.get_text(separator="\n"),
-                'questions': question_list
-            }
+        return prompt.format_messages(
+            passage=self.page['passage'],
+            questions=format_numbered(self.page['questions'])
         )
-        answers = response.answers
-        super()._input_with_log(question_list, answers)
-        click_button(driver, "div.question-common-course-page>a.btn")
-        return answers
 
 class VideoWithChoiceHandler(GeneralChoiceHandler):
     def _get_plain_text(self) -> str:
-        return _parse_video_text()
+        return _parse_video_text(self.snapshot)
 
     def _post_handle(self, answers) -> bool:
         if self._check_score_with_retry(answers):
@@ -446,7 +822,7 @@ class VideoWithChoiceHandler(GeneralChoiceHandler):
 
 class VideoWithBlankFillingHandler(MediaBlankFillingHandler):
     def _get_plain_text(self) -> str:
-        return _parse_video_text()
+        return _parse_video_text(self.snapshot)
 
     def _post_handle(self, answers) -> bool:
         if self._check_score_with_retry(answers):
@@ -458,32 +834,32 @@ class VideoWithBlankFillingHandler(MediaBlankFillingHandler):
 
 class VideoWatchHandler(BaseHandler):
     def _internal_handle(self):
-        video_boxes = driver.find_elements(By.CLASS_NAME, "video-box")
+        video_boxes = find_all(driver, ".video-box", timeout=5)
         logger.info(f"当前页面共有{len(video_boxes)}个视频, 开始遍历")
         for index, video_box in enumerate(video_boxes):
-            video = video_box.find_element(By.TAG_NAME, "video")
+            video = find(video_box, "video", timeout=5)
+            if video is None:
+                logger.info(f"第{index + 1}个视频没有加载出来, 跳过")
+                continue
             logger.info(f"播放第{index + 1}个视频")
             driver.execute_script("arguments[0].pause(); arguments[0].play();", video)
             duration = driver.execute_script("return arguments[0].duration;", video)
             try:
                 video_box.find_elements(By.CLASS_NAME, "controlBtn")[0].click()  # 倍速按钮
-                time.sleep(0.5)
+                WebDriverWait(driver, 2).until(lambda _: len(video_box.find_elements(By.CLASS_NAME, "textOption")) > 5)
                 video_box.find_elements(By.CLASS_NAME, "textOption")[5].click()  # 选择2倍速
                 logger.info("视频调整为2倍速播放")
             except Exception:
                 logger.info("倍速调整失败")
             logger.info(f"视频时长为{duration / 2}秒, 请耐心等待")
-            if config["unipus"]["video_full"]:
-                time.sleep(duration / 2)
-            else:
-                time.sleep(float(config["unipus"]["video_sleep"]))
+            seconds = duration / 2 if config["unipus"]["video_full"] else float(config["unipus"]["video_sleep"])
+            with tracer.span("sleep.video", seconds=seconds):
+                time.sleep(seconds)
             logger.info("当前视频播放完毕")
 
 class ArticleWithChoiceHandler(GeneralChoiceHandler):
     def _get_plain_text(self) -> str:
-        text_soup = BeautifulSoup(
-            driver.find_element(By.CSS_SELECTOR, "div.text-material-wrapper").get_attribute("outerHTML"), 'lxml')
-        return text_soup.get_text(separator="\n")
+        return self.snapshot.passage
 
     def _post_handle(self, answers) -> bool:
         if self._check_score_with_retry(answers):
@@ -494,6 +870,7 @@ class ArticleWithChoiceHandler(GeneralChoiceHandler):
         return True
 
 class WordCorrectionHandler(GeneralBlankFillingHandler):
+    _schema = WordCorrectionAnswer
     def _post_handle(self, answers) -> bool:
         if self._check_score_with_retry(answers):
             logger.info(f"完成本次词汇纠正答题, 最终分数: {self.score}")
@@ -502,70 +879,118 @@ class WordCorrectionHandler(GeneralBlankFillingHandler):
 
         return True
 
-    def _internal_handle(self):
-        text_wrapper = driver.find_element(By.CSS_SELECTOR, "div.question-common-abs-scoop>div>div")
-        text_soup = BeautifulSoup(text_wrapper.get_attribute("outerHTML"), 'lxml')
-        for span in text_soup.select("span.fe-scoop"):
-            span.replace_with('___')
-        text = text_soup.get_text(separator="\n")
+    def _scrape(self) -> dict:
+        return {
+            'text': self.snapshot.correction_text
+        }
+
+    def _build_messages(self) -> list:
         prompt = ChatPromptTemplate.from_template(
             """
             根据下列内容，将文本内的下划线(___)替换为后面括号内正确的英文单词，并使用正确的英文单词形式, 并按照顺序返回英文单词列表
-            其他提示通常为错误的答案提示，不可完全重复了
             内容:
             {content}
-            其他提示: {retry_message}
             """
         )
-        chain = prompt | llm.with_structured_output(WordCorrectionAnswer)
-        response = chain.invoke(
-            {
-                'content': text,
-                'retry_message': self.retry_messages,
-            }
+        return prompt.format_messages(
+            content=self.page['text']
         )
-        answers = response.blanks
-        super()._fill_blanks(answers)
+
+    def _internal_handle(self):
+        input_fields = find_all(driver, 'div.comp-scoop-reply input', timeout=5)
+        answers = self._answer(self._schema, {'blanks': len(input_fields)},
+                               self._stream_fill(input_fields)).blanks
+        self._fill_blanks(input_fields, answers)
         click_button(driver, "div.question-common-course-page>a.btn")
+        return answers
+
+def _plan_moves(current: list[int], target: list[int]) -> list[tuple[int, int]]:
+    """
+    规划最少的移动次数: 当前顺序中按目标位置递增的最长子序列保持不动, 其余元素按目标顺序依次插到前一个元素之后
+    :param current: 当前顺序 (选项序号)
+    :param target: 目标顺序 (选项序号)
+    :return: [(移动前的位置, 移动后的位置)], 按顺序执行, 每次移动为取出后插入
+    """
+    rank = {element: position for position, element in enumerate(target)}
+    ranks = [rank[element] for element in current]
+    # 最长递增子序列, 元素数量很少, 直接使用 O(n^2) 的动态规划
+    lengths = [1] * len(ranks)
+    previous = [-1] * len(ranks)
+    for i in range(len(ranks)):
+        for j in range(i):
+            if ranks[j] < ranks[i] and lengths[j] + 1 > lengths[i]:
+                lengths[i], previous[i] = lengths[j] + 1, j
+    fixed = set()
+    i = max(range(len(ranks)), key=lambda index: lengths[index], default=-1)
+    while i >= 0:
+        fixed.add(current[i])
+        i = previous[i]
+
+    order = list(current)
+    moves = []
+    for position, element in enumerate(target):
+        if element in fixed:
+            continue
+        from_pos = order.index(element)
+        order.pop(from_pos)
+        to_pos = order.index(target[position - 1]) + 1 if position > 0 else 0
+        order.insert(to_pos, element)
+        moves.append((from_pos, to_pos))
+        fixed.add(element)
+    return moves
+
 
 class GeneralDragElementHandler(BaseHandler):
+    _schema = DragElementAnswer
+    _item_selector = "div.sortable-list-wrapper>div#sequenceReplyViewItemText"
+
+    def __init__(self):
+        super().__init__()
+        # 本页验证有效的拖拽方式, 后续移动优先使用
+        self._drag_strategy: Optional[str] = None
+
+    def reset(self, task_key: Optional[tuple] = None):
+        super().reset(task_key)
+        self._drag_strategy = None
+
     @abstractmethod
     def _get_plain_text(self) -> str:
         pass
 
-    def _internal_handle(self) -> list[str]:
-        tip_list = _extract_tips()
-        elements = driver.find_elements(By.CSS_SELECTOR, "div.sortable-list-wrapper>div#sequenceReplyViewItemText")
-        choices = [get_pure_text(element) for element in elements]
+    def _scrape(self) -> dict:
+        return {
+            'tips': self.snapshot.tips,
+            'choices': self.snapshot.sortable_items
+        }
+
+    def _build_messages(self) -> list:
         prompt = ChatPromptTemplate.from_template(
             """
             你将要通过一些内容与提示把答案进行排序，将选项的ABCD映射为0123等，然后进行答案排序，按排序后的顺序列表返回,
             如果你觉得信息不足，则随机返回答案顺序
-            其他提示通常为错误的答案提示，不可完全重复了
             内容:
             {content}
-            提示(列表): 
+            提示:
             {tips}
-            选项列表:
+            选项(序号从0开始):
             {choices}
-            其他提示: {retry_message}
             """
         )
-        chain = prompt | llm.with_structured_output(DragElementAnswer)
-
-        response = chain.invoke(
-            {
-                'content': self._get_plain_text(),
-                'tips': tip_list,
-                'choices': choices,
-                'retry_message': self.retry_messages
-            }
+        return prompt.format_messages(
+            content=self._get_plain_text(),
+            tips=format_tips(self.page['tips']),
+            choices=format_numbered(self.page['choices'], start=0)
         )
 
+    def _internal_handle(self) -> list[str]:
+        choices = self.page['choices']
+        response = self._answer(self._schema, {})
+
         orders: list[int] = response.orders
 
         # 验证和修复orders
-        orders = self.validate_and_fix_orders(orders, len(elements))
+        orders = self.validate_and_fix_orders(orders, len(choices))
+        response.orders = orders
 
         logger.info(f"开始进行拖拽排序, 目标顺序: {orders}")
         logger.info(f"当前选项: {[f'{i}:{choices[i][:20]}...' for i in range(len(choices))]}")
@@ -636,9 +1061,11 @@ class GeneralDragElementHandler(BaseHandler):
         logger.info(f"修复后的orders: {orders}")
         return orders
 
+    @tracer.traced("fill.sort")
     def perform_optimized_drag_sort(self, target_orders: list[int], choices: list[str]) -> bool:
         """
-        执行优化的拖拽排序 - 使用逐个调整法
+        执行拖拽排序 - 保持当前顺序中的最长递增子序列不动, 只移动其余元素
+        每次移动后重新读取页面顺序并重新规划, 拖拽结果与预期不符时也能继续
 
         Args:
             target_orders: 目标顺序
@@ -648,33 +1075,25 @@ class GeneralDragElementHandler(BaseHandler):
             bool: 是否成功
         """
         try:
-            actions = ActionChains(driver)
-            current_order = list(range(len(target_orders)))
-
+            current_order = self.read_current_order(choices) or list(range(len(target_orders)))
             logger.info(f"开始排序，当前顺序: {current_order}, 目标顺序: {target_orders}")
-
-            # 逐个位置调整到正确位置
-            for target_pos in range(len(target_orders)):
-                target_element_idx = target_orders[target_pos]
-                current_pos = current_order.index(target_element_idx)
-
-                if current_pos == target_pos:
-                    logger.debug(f"位置{target_pos}的元素{target_element_idx}已在正确位置")
-                    continue
-
-                logger.info(
-                    f"调整位置{target_pos}: 将元素{target_element_idx}从位置{current_pos}移动到位置{target_pos}")
-
-                # 执行拖拽移动
-                if self.execute_drag_move(current_pos, target_pos, target_element_idx, choices):
-                    # 更新current_order以反映移动
-                    element = current_order.pop(current_pos)
-                    current_order.insert(target_pos, element)
-                    logger.debug(f"移动后当前顺序: {current_order}")
-                    time.sleep(0.6)  # 等待DOM稳定
-                else:
-                    logger.error(f"移动失败: 元素{target_element_idx} 从{current_pos}到{target_pos}")
+            logger.info(f"规划移动{len(_plan_moves(current_order, target_orders))}次")
+
+            # 每次移动至少使一个元素归位, 额外的次数留给拖拽结果与预期不符的情况
+            for _ in range(len(target_orders) * 2):
+                moves = _plan_moves(current_order, target_orders)
+                if not moves:
+                    break
+                from_pos, to_pos = moves[0]
+                element_idx = current_order[from_pos]
+                logger.info(f"将元素{element_idx}从位置{from_pos}移动到位置{to_pos}")
+
+                moved_order = self.execute_drag_move(from_pos, to_pos, current_order, choices)
+                if moved_order is None:
+                    logger.error(f"移动失败: 元素{element_idx} 从{from_pos}到{to_pos}")
                     return False
+                current_order = moved_order
+                logger.debug(f"移动后当前顺序: {current_order}")
 
             # 最终验证
             return self.verify_final_order(target_orders, choices)
@@ -683,18 +1102,38 @@ class GeneralDragElementHandler(BaseHandler):
             logger.error(f"拖拽排序过程中发生错误: {e}")
             return False
 
-    def execute_drag_move(self, from_pos: int, to_pos: int, element_idx: int, choices: list[str]) -> bool:
+    def read_current_order(self, choices: list[str]) -> Optional[list[int]]:
         """
-        执行单次拖拽移动 - 使用更精确的方法
+        一次脚本调用读取页面中选项的当前顺序, 无法与选项文本对应时返回 None
         """
+        indices_by_text: dict[str, list[int]] = {}
+        for index, choice in enumerate(choices):
+            indices_by_text.setdefault(choice.strip(), []).append(index)
+        order = []
+        for text in get_pure_texts(driver, self._item_selector):
+            indices = indices_by_text.get(text.strip())
+            if not indices:
+                return None
+            order.append(indices.pop(0))
+        return order if len(order) == len(choices) else None
+
+    @tracer.traced("fill.drag")
+    def execute_drag_move(self, from_pos: int, to_pos: int, current_order: list[int],
+                          choices: list[str]) -> Optional[list[int]]:
+        """
+        执行单次拖拽移动, 优先使用本页已验证有效的拖拽方式
+        :return: 移动后的顺序, 所有方式都没有改变顺序时返回 None
+        """
+        element_idx = current_order[from_pos]
+        expected_order = current_order.copy()
+        expected_order.insert(to_pos, expected_order.pop(from_pos))
         try:
             # 重新获取当前元素列表
-            current_elements = driver.find_elements(By.CSS_SELECTOR,
-                                                    "div.sortable-list-wrapper>div#sequenceReplyViewItemText")
+            current_elements = driver.find_elements(By.CSS_SELECTOR, self._item_selector)
 
             if from_pos >= len(current_elements) or to_pos >= len(current_elements):
                 logger.error(f"位置索引超出范围: from={from_pos}, to={to_pos}, total={len(current_elements)}")
-                return False
+                return None
 
             source_element = current_elements[from_pos]
 
@@ -706,28 +1145,35 @@ class GeneralDragElementHandler(BaseHandler):
 
             # 滚动到元素可见
             driver.execute_script("arguments[0].scrollIntoView({block: 'center'});", source_element)
-            time.sleep(0.3)
-
-            # 尝试多种拖拽策略
-            success = False
-
-            # 策略1: 移动到目标位置的精确坐标
-            if not success:
-                success = self.try_precise_coordinate_drag(source_element, from_pos, to_pos, current_elements,
-                                                           element_idx)
-
-            # 策略2: 使用HTML5拖拽API（如果支持）
-            if not success:
-                success = self.try_html5_drag(source_element, current_elements[to_pos], element_idx)
-
-            # 策略3: 传统的move_to_element方法
-            if not success:
-                success = self.try_traditional_drag(source_element, current_elements[to_pos], element_idx)
-
-            if success:
-                logger.debug(f"成功拖拽元素{element_idx} ('{choices[element_idx][:15]}...')")
+            wait_for_settled(driver, timeout=1)
+
+            # 拖拽策略: 精确坐标, HTML5拖拽API, 传统的move_to_element方法
+            strategies = {
+                'precise': lambda: self.try_precise_coordinate_drag(source_element, from_pos, to_pos,
+                                                                    current_elements, element_idx),
+                'html5': lambda: self.try_html5_drag(source_element, current_elements[to_pos], element_idx),
+                'traditional': lambda: self.try_traditional_drag(source_element, current_elements[to_pos],
+                                                                 element_idx)
+            }
+            names = sorted(strategies, key=lambda name: name != self._drag_strategy)
 
-            return success
+            for name in names:
+                if not strategies[name]():
+                    continue
+                actual_order = self.read_current_order(choices)
+                if actual_order is None or actual_order == expected_order:
+                    # 读不出顺序时无法验证, 按拖拽未报错处理
+                    if name != self._drag_strategy:
+                        logger.info(f"拖拽方式{name}有效, 本页后续移动优先使用")
+                        self._drag_strategy = name
+                    logger.debug(f"成功拖拽元素{element_idx} ('{choices[element_idx][:15]}...')")
+                    return expected_order if actual_order is None else actual_order
+                if actual_order != current_order:
+                    # 顺序已被改变但与预期不同, 不再尝试其他方式, 由上层重新规划
+                    logger.warning(f"拖拽方式{name}移动结果与预期不符: {actual_order}")
+                    return actual_order
+                logger.debug(f"拖拽方式{name}没有改变顺序")
+            return None
 
         except Exception as e:
             logger.error(f"拖拽操作失败: {e}")
@@ -736,7 +1182,7 @@ class GeneralDragElementHandler(BaseHandler):
                 ActionChains(driver).release().perform()
             except:
                 pass
-            return False
+            return None
 
     def try_precise_coordinate_drag(self, source_element, from_pos: int, to_pos: int, elements: list,
                                     element_idx: int) -> bool:
@@ -781,7 +1227,7 @@ class GeneralDragElementHandler(BaseHandler):
             actions.release()
             actions.perform()
 
-            time.sleep(0.5)
+            wait_for_settled(driver, timeout=2)
             return True
 
         except Exception as e:
@@ -814,7 +1260,7 @@ class GeneralDragElementHandler(BaseHandler):
             """
 
             driver.execute_script(js_drag_script, source_element, target_element)
-            time.sleep(0.5)
+            wait_for_settled(driver, timeout=2)
             return True
 
         except Exception as e:
@@ -836,7 +1282,7 @@ class GeneralDragElementHandler(BaseHandler):
             actions.release()
             actions.perform()
 
-            time.sleep(0.5)
+            wait_for_settled(driver, timeout=2)
             return True
 
         except Exception as e:
@@ -852,11 +1298,9 @@ class GeneralDragElementHandler(BaseHandler):
         验证最终顺序是否正确
         """
         try:
-            time.sleep(1)  # 等待所有动画完成
+            wait_for_settled(driver, timeout=3)  # 等待所有动画完成
 
-            final_elements = driver.find_elements(By.CSS_SELECTOR,
-                                                  "div.sortable-list-wrapper>div#sequenceReplyViewItemText")
-            actual_texts = [get_pure_text(elem) for elem in final_elements]
+            actual_texts = get_pure_texts(driver, self._item_selector)
             expected_texts = [original_choices[i] for i in expected_orders]
 
             logger.info(f"期望的最终顺序: {expected_orders}")
@@ -893,7 +1337,7 @@ class GeneralDragElementHandler(BaseHandler):
 
 class AudioDragElementHandler(GeneralDragElementHandler):
     def _get_plain_text(self) -> str:
-        return _parse_audio_text()
+        return _parse_audio_text(self.snapshot)
 
     def _post_handle(self, answers) -> bool:
         if self._check_score_with_retry(answers):
@@ -905,7 +1349,7 @@ class AudioDragElementHandler(GeneralDragElementHandler):
 
 class VideoDragElementHandler(GeneralDragElementHandler):
     def _get_plain_text(self) -> str:
-        return _parse_video_text()
+        return _parse_video_text(self.snapshot)
 
     def _post_handle(self, answers) -> bool:
         if self._check_score_with_retry(answers):
@@ -916,79 +1360,74 @@ class VideoDragElementHandler(GeneralDragElementHandler):
         return True
 
 class GeneralSelectionHandler(BaseHandler):
+    _schema = SelectionAnswer
+    _result_selector = "div.comp-scoop-reply-dropdown-selection-overflow tbody>tr > *:nth-child(2)"
+    _answer_field = 'captions'
+
     @abstractmethod
     def _get_plain_text(self) -> str:
         pass
 
-    def _internal_handle(self) -> list[str]:
-        questions = driver.find_elements(By.CSS_SELECTOR, "div.comp-scoop-reply-dropdown-selection-overflow tbody>tr > *:nth-child(2)")
-
-        question_list = []
-        for question in questions:
-            soup = BeautifulSoup(question.get_attribute("outerHTML"), 'lxml')
-            direct_text = ''
-
-            for children in soup.td.children:
-                if isinstance(children, NavigableString):
-                    direct_text += children.text
-            ol = soup.find("ol")
-            li_elements = ol.find_all("li") if ol else []
-            question_list.append(
-                {
-                    "question": direct_text,
-                    "options": [Choice(caption=str(index), content=li.get_text()) for index, li in enumerate(li_elements)]
-                }
-            )
-
-        print(question_list)
+    def _scrape(self) -> dict:
+        return {
+            'tips': self.snapshot.tips,
+            'questions': self.snapshot.selection_questions
+        }
 
+    def _build_messages(self) -> list:
         prompt = ChatPromptTemplate.from_template(
             """
             你将要通过一些内容与提示推断出最符合问题的答案, 每个问题的答案选择数字选项的其中一个, 答案以问题的顺序按列表返回
-            其他提示通常为错误的答案提示，不可完全重复了
             内容:
             {content}
-            提示(列表): 
+            提示:
             {tips}
-            答案:
+            问题与选项:
             {choices}
-            其他提示: {retry_message}
             """
         )
-        chain = prompt | llm.with_structured_output(SelectionAnswer)
-
-        response = chain.invoke(
-            {
-                'content': self._get_plain_text(),
-                'tips': _extract_tips(),
-                'choices': question_list,
-                'retry_message': self.retry_messages
-            }
+        return prompt.format_messages(
+            content=self._get_plain_text(),
+            tips=format_tips(self.page['tips']),
+            choices=format_questions(self.page['questions'])
         )
 
-        captions: list[int] = response.captions
+    def _internal_handle(self) -> list[str]:
+        questions = find_all(driver, self._result_selector, timeout=5)
+        select = lambda _, index, caption: self._select(questions, index, caption)
+        # 只重做错题时回调只选择答错的题目, 重做页面可能清空了其他题的选择, 作答后重新选择其余题目
+        requeried = set((self.wrong_items or {}).get(self._answer_field, [])) if self.wrong_items else None
+        captions: list[int] = self._answer(self._schema, {'captions': len(questions)}, select).captions
+        if requeried is not None:
+            for index, caption in enumerate(captions):
+                if index not in requeried:
+                    self._select(questions, index, caption)
 
         logger.info(f"下拉选择答题目标答案: {captions}")
 
         if len(captions) != len(questions):
             logger.warning("答案数量不足，请检查答案数量是否正确")
-        else:
-            for index, question in enumerate(questions):
-                selection_element = question.find_element(By.CSS_SELECTOR,
-                                                          "span.scoop-select-wrapper>span.input-wrapper")
-                selection_button = selection_element.find_element(By.CSS_SELECTOR, "span.ant-dropdown-trigger")
-                selection_button.click()
-                time.sleep(0.2)
-                selections = selection_element.find_elements(By.CSS_SELECTOR, "li")
-                if but := selections[captions[index]]:
-                    but.click()
 
         click_button(driver, "div.question-common-course-page>a.btn")
         return [str(caption) for caption in captions]
 
+    @tracer.traced("fill.select")
+    def _select(self, questions: list[WebElement], index: int, caption: int):
+        if index > len(questions) - 1:
+            return
+        selection_element = questions[index].find_element(By.CSS_SELECTOR,
+                                                          "span.scoop-select-wrapper>span.input-wrapper")
+        selection_button = selection_element.find_element(By.CSS_SELECTOR, "span.ant-dropdown-trigger")
+        selection_button.click()
+        selections = WebDriverWait(driver, 2).until(
+            lambda _: selection_element.find_elements(By.CSS_SELECTOR, "li")
+        )
+        if 0 <= caption < len(selections):
+            selections[caption].click()
+
 class AudioSelectionHandler(GeneralSelectionHandler):
     def _get_plain_text(self) -> str:
-        return _parse_audio_text()
+        return _parse_audio_text(self.snapshot)
 
     def _post_handle(self, answers) -> bool:
         if self._check_score_with_retry(answers):
@@ -1000,7 +1439,7 @@ class AudioSelectionHandler(GeneralSelectionHandler):
 
 class VideoSelectionHandler(GeneralSelectionHandler):
     def _get_plain_text(self) -> str:
-        return _parse_video_text()
+        return _parse_video_text(self.snapshot)
 
     def _post_handle(self, answers) -> bool:
         if self._check_score_with_retry(answers):
@@ -1012,55 +1451,49 @@ class VideoSelectionHandler(GeneralSelectionHandler):
 
 
 
+@tracer.traced("find_handler")
 def find_handler() -> Optional[BaseHandler]:
-    set_timeout = False
-    try:
-        if driver is None:
-            return None
-        driver.implicitly_wait(0)
-        set_timeout = True
-        # if find_element_safely(driver, "div.layout-container.discussion-view"):
-        #     logger.info("发现讨论题处理器")
-        #     return DiscussionHandler()
-        # if find_element_safely(driver, "div.audio-material-wrapper") and find_element_safely(driver, "div.comp-scoop-reply")\
-        #     and not find_element_safely(driver, "div.comp-scoop-reply-dropdown-selection-overflow"):
-        #     logger.info("发现音频填空题处理器")
-        #     return AudioWithBlankFillingHandler()
-        # if find_element_safely(driver, "div.audio-material-wrapper") and find_element_safely(driver,"div.question-common-abs-choice"):
-        #     logger.info("发现音频选择题处理器")
-        #     return AudioWithChoiceHandler()
-        # if find_element_safely(driver, "div.video-material-wrapper") and find_element_safely(driver, "div.comp-scoop-reply") \
-        #         and not find_element_safely(driver, "div.comp-scoop-reply-dropdown-selection-overflow"):
-        #     logger.info("发现视频填空题处理器")
-        #     return VideoWithBlankFillingHandler()
-        # if find_element_safely(driver, "div.video-material-wrapper") and find_element_safely(driver,"div.question-common-abs-choice"):
-        #     logger.info("发现视频选择题处理器")
-        #     return VideoWithChoiceHandler()
-        # if find_element_safely(driver, "div.text-material-wrapper") and find_element_safely(driver, "div.question-common-abs-choice"):
-        #     logger.info("发现文本选择题处理器")
-        #     return ArticleWithChoiceHandler()
-        # if find_element_safely(driver, "div.audio-material-wrapper") and find_element_safely(driver, "div.question-inputbox"):
-        #     logger.info("发现音频观点题处理器")
-        #     return IdeaWithAudioOrVideoHandler()
-        # if find_element_safely(driver, "div.video-material-wrapper") and find_element_safely(driver, "div.question-inputbox"):
-        #     logger.info("发现视频观点题处理器")
-        #     return IdeaWithAudioOrVideoHandler()
-        # if find_element_safely(driver, "div.text-material-wrapper") and find_element_safely(driver, "div.question-inputbox"):
-        #     logger.info("发现文本观点题处理器")
-        #     return IdeaWithArticleHandler()
-        # if find_element_safely(driver, "div.layout-reply-container.full") and find_element_safely(driver,"div.comp-scoop-reply"):
-        #     logger.info("发现词汇纠正题处理器")
-        #     return WordCorrectionHandler()
-        # if find_element_safely(driver, "div.question-video-point-read"):
-        #     logger.info("发现视频观看处理器")
-        #     return VideoWatchHandler()
-        from handler import find_handler_by_driver
-        handler = find_handler_by_driver(driver)
-        if handler:
-            logger.info(f"发现处理器: {handler.__class__.__name__}")
-            return handler
-        logger.info("没有发现处理器处理本页")
+    if driver is None:
         return None
-    finally:
-        if set_timeout:
-            driver.implicitly_wait(1)
+    # if find_element_safely(driver, "div.layout-container.discussion-view"):
+    #     logger.info("发现讨论题处理器")
+    #     return DiscussionHandler()
+    # if find_element_safely(driver, "div.audio-material-wrapper") and find_element_safely(driver, "div.comp-scoop-reply")\
+    #     and not find_element_safely(driver, "div.comp-scoop-reply-dropdown-selection-overflow"):
+    #     logger.info("发现音频填空题处理器")
+    #     return AudioWithBlankFillingHandler()
+    # if find_element_safely(driver, "div.audio-material-wrapper") and find_element_safely(driver,"div.question-common-abs-choice"):
+    #     logger.info("发现音频选择题处理器")
+    #     return AudioWithChoiceHandler()
+    # if find_element_safely(driver, "div.video-material-wrapper") and find_element_safely(driver, "div.comp-scoop-reply") \
+    #         and not find_element_safely(driver, "div.comp-scoop-reply-dropdown-selection-overflow"):
+    #     logger.info("发现视频填空题处理器")
+    #     return VideoWithBlankFillingHandler()
+    # if find_element_safely(driver, "div.video-material-wrapper") and find_element_safely(driver,"div.question-common-abs-choice"):
+    #     logger.info("发现视频选择题处理器")
+    #     return VideoWithChoiceHandler()
+    # if find_element_safely(driver, "div.text-material-wrapper") and find_element_safely(driver, "div.question-common-abs-choice"):
+    #     logger.info("发现文本选择题处理器")
+    #     return ArticleWithChoiceHandler()
+    # if find_element_safely(driver, "div.audio-material-wrapper") and find_element_safely(driver, "div.question-inputbox"):
+    #     logger.info("发现音频观点题处理器")
+    #     return IdeaWithAudioOrVideoHandler()
+    # if find_element_safely(driver, "div.video-material-wrapper") and find_element_safely(driver, "div.question-inputbox"):
+    #     logger.info("发现视频观点题处理器")
+    #     return IdeaWithAudioOrVideoHandler()
+    # if find_element_safely(driver, "div.text-material-wrapper") and find_element_safely(driver, "div.question-inputbox"):
+    #     logger.info("发现文本观点题处理器")
+    #     return IdeaWithArticleHandler()
+    # if find_element_safely(driver, "div.layout-reply-container.full") and find_element_safely(driver,"div.comp-scoop-reply"):
+    #     logger.info("发现词汇纠正题处理器")
+    #     return WordCorrectionHandler()
+    # if find_element_safely(driver, "div.question-video-point-read"):
+    #     logger.info("发现视频观看处理器")
+    #     return VideoWatchHandler()
+    from handler import find_handler_by_driver
+    handler = find_handler_by_driver(driver)
+    if handler:
+        logger.info(f"发现处理器: {handler.__class__.__name__}")
+        return handler
+    logger.info("没有发现处理器处理本页")
+    return None
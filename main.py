@@ -1,14 +1,22 @@
+import argparse
 import os
 import subprocess
-import time
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
-from selenium.webdriver.common.by import By
 
 from runner import driver
-from runner.selenium_runner import login, access_book_pages, get_pages, access_page, auto_answer_questions
+from runner.worker_pool import answer_pages_parallel
+from runner.crawler import crawl_book, load_manifest, summarize_manifest
+from runner.selenium_runner import login, access_book_pages, get_pages, get_page_name, access_page, \
+    auto_answer_questions
+from util import audio_parser
 from util.config import config
-from util.download import download_file
+from util.download import download_file, get_cache_path
+from util.journal import journal
 from util.log import logger
+from util.metrics import latency, prompt_tokens
+from util.selenium import wait_for_settled, is_session_alive, SESSION_ERRORS
 
 
 def check_ffmpeg_in_path():
@@ -60,29 +68,243 @@ def get_ffmpeg_bin_dir():
     download_ffmpeg()
     return get_ffmpeg_bin_dir()  # 重新获取路径
 
-if __name__ == '__main__':
-    ffmpeg_bin_dir = get_ffmpeg_bin_dir()
+def configured_offsets() -> tuple[int, int, int]:
+    return (int(config['unipus']['offset_page']), int(config['unipus']['offset_tab']),
+            int(config['unipus']['offset_task']))
 
-    if ffmpeg_bin_dir:
-        os.environ["PATH"] += os.pathsep + ffmpeg_bin_dir
 
-    logger.warning("请确保你有足够的流量以下载大量的音视频文件")
-    logger.warning("如有支持CUDA的显卡, 请开启CUDA以加速计算能力")
+def resume_offsets(book: str) -> tuple[int, int, int]:
+    """
+    根据进度日志从第一个未完成的任务继续 (之前失败的任务会重做, 之后已完成的任务由进度日志跳过),
+    配置中的偏移量更靠后或没有记录时使用配置中的偏移量
+    :return: (页面偏移, 栏目偏移, 任务偏移)
+    """
+    configured = configured_offsets()
+    position = journal.resume_position(book) if journal else None
+    if position is None or position <= configured:
+        return configured
+    logger.info(f"从进度日志恢复: 第{position[0]}页, 第{position[1]}个栏目, 第{position[2]}个任务, "
+                f"代替配置中的偏移量 {list(configured)}")
+    return position
+
 
+def answer_book(offsets: tuple[int, int, int] = None) -> set[str]:
+    """
+    登录并从上次的进度开始答题
+    :param offsets: 指定的 (页面偏移, 栏目偏移, 任务偏移), 为空时从进度日志恢复
+    :return: 答题失败的任务
+    """
+    book = config['unipus']['book']
+    workers = int(config['unipus'].get('workers', 1))
     login(driver)
     access_book_pages(driver)
     pages = get_pages(driver)
-    logger.info(f"获取书籍所有目录, 偏移量: {config['unipus']['offset_page']}, 页面数: {len(pages)}")
-    pages = pages[int(config['unipus']['offset_page']):]
-    for i, page in enumerate(pages):
-        logger.info(f"开始处理第 {i} 页")
+    if workers > 1:
+        # 并行时页面完成顺序不定, 从配置的偏移量开始, 已完成的任务由进度日志跳过
+        return answer_pages_parallel(len(pages), offsets or configured_offsets(), workers)
+
+    offset_page, offset_tab, offset_task = offsets or resume_offsets(book)
+    logger.info(f"获取书籍所有目录, 偏移量: {offset_page}, 页面数: {len(pages)}")
+    failed_questions = set()
+    for i, page in enumerate(pages[offset_page:]):
+        logger.info(f"开始处理第 {offset_page + i} 页")
         access_page(driver, page)
-        auto_answer_questions(
+        failed_questions |= auto_answer_questions(
             driver=driver,
-            page_name=page.find_element(By.CSS_SELECTOR, "span.pc-menu-node-name").text,
-            offset_tab=int(config['unipus']['offset_tab']) if i == 0  else 0,
-            offset_task=int(config['unipus']['offset_task']) if i == 0  else 0
+            page_name=get_page_name(page),
+            offset_tab=offset_tab if i == 0 else 0,
+            offset_task=offset_task if i == 0 else 0,
+            page_index=offset_page + i
         )
-        time.sleep(float(config['unipus']['page_wait']))
+        wait_for_settled(driver, min_delay=float(config['unipus'].get('page_wait', 0)))
+    return failed_questions
+
+
+def setup_ffmpeg():
+    ffmpeg_bin_dir = get_ffmpeg_bin_dir()
+
+    if ffmpeg_bin_dir:
+        os.environ["PATH"] += os.pathsep + ffmpeg_bin_dir
+
+
+def manifest_media(manifest: dict) -> list[tuple[str, bool]]:
+    """
+    清单中去重后的音视频地址
+    :return: [(地址, 是否为视频)]
+    """
+    media = {}
+    for task in manifest['tasks']:
+        if task['audio']:
+            media.setdefault(task['audio'], False)
+        if task['video']:
+            media.setdefault(task['video'], True)
+    return list(media.items())
+
+
+def run_media_jobs(name: str, func, media: list[tuple[str, bool]], workers: int):
+    """
+    在线程池中处理清单中的音视频, 单个文件失败不影响其他文件
+    """
+    logger.info(f"{name}: 共{len(media)}个音视频, 并发数{workers}")
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=name) as executor:
+        futures = {executor.submit(func, url, video): url for url, video in media}
+        for future, url in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                logger.error(f"{name}失败 {url}: {e}")
+    logger.info(f"{name}完成: 成功{len(media) - failed}个, 失败{failed}个")
+
+
+def load_book_manifest(path: str = None) -> dict:
+    """
+    读取清单并检查是否属于当前图书
+    """
+    manifest = load_manifest(path)
+    book = config['unipus']['book']
+    if manifest.get('book') != book:
+        raise ValueError(f"清单属于图书 {manifest.get('book')}, 与当前图书 {book} 不一致, 请重新运行 crawl 或指定 --book")
+    return manifest
+
+
+def require_manifest(path: str = None) -> dict:
+    try:
+        return load_book_manifest(path)
+    except (FileNotFoundError, ValueError) as e:
+        raise SystemExit(f"无法使用书籍清单: {e}")
+
+
+def command_crawl(args):
+    login(driver)
+    access_book_pages(driver)
+    crawl_book(driver, get_pages(driver), int(config['unipus']['offset_page']), args.manifest)
+
+
+def command_prefetch(args):
+    media = manifest_media(require_manifest(args.manifest))
+    run_media_jobs("prefetch", lambda url, video: download_file(url), media, args.workers)
+
+
+def command_transcribe(args):
+    setup_ffmpeg()
+
+    def transcribe(url: str, video: bool):
+        # 未提前下载的文件在这里下载, 转录文本写入缓存目录供答题时读取
+        path = download_file(url)
+        if video:
+            audio_parser.from_video(path)
+        else:
+            audio_parser.from_audio(path)
+
+    run_media_jobs("transcribe", transcribe, manifest_media(require_manifest(args.manifest)), args.workers)
+
+
+def command_answer(args):
+    setup_ffmpeg()
+
+    logger.warning("请确保你有足够的流量以下载大量的音视频文件")
+    logger.warning("如有支持CUDA的显卡, 请开启CUDA以加速计算能力")
+
+    if args.workers is not None:
+        config['unipus']['workers'] = args.workers
+    # 命令行指定了偏移量时不从进度日志恢复
+    explicit = any(getattr(args, key, None) is not None for key in ('offset_page', 'offset_tab', 'offset_task'))
+    offsets = configured_offsets() if explicit else None
+    max_restarts = int(config['selenium'].get('max_restarts', 3))
+    failed_questions = set()
+    for restart in range(max_restarts + 1):
+        try:
+            failed_questions |= answer_book(offsets)
+            break
+        except SESSION_ERRORS as e:
+            # 浏览器或 chromedriver 崩溃时重启并从进度日志继续, 其他错误照常抛出
+            if is_session_alive(driver) or restart == max_restarts:
+                raise
+            logger.warning(f"浏览器会话断开, 重启浏览器后继续 ({restart + 1}/{max_restarts}): {e}")
+            driver.restart()
+            offsets = None
 
+    if journal:
+        failed_questions = journal.failed_tasks(config['unipus']['book'])
+    if failed_questions:
+        logger.warning(f"答题失败的任务({len(failed_questions)}): {', '.join(sorted(failed_questions))}")
+    logger.info(f"耗时统计:\n{latency.summary()}")
+    logger.info(f"提示词统计:\n{prompt_tokens.summary()}")
 
+
+def command_report(args):
+    book = config['unipus']['book']
+    if journal:
+        logger.info(f"答题进度:\n{journal.summarize(book)}")
+        failed = journal.failed_tasks(book)
+        if failed:
+            logger.warning(f"答题失败的任务({len(failed)}): {', '.join(failed)}")
+    else:
+        logger.info("未开启进度日志 (unipus.journal)")
+    try:
+        manifest = load_book_manifest(args.manifest)
+    except FileNotFoundError:
+        logger.info("没有书籍清单, 可先运行 crawl 生成")
+        return
+    except ValueError as e:
+        logger.warning(str(e))
+        return
+    media = manifest_media(manifest)
+    downloaded = [get_cache_path(url) for url, video in media if os.path.exists(get_cache_path(url))]
+    transcribed = [path for path in downloaded if os.path.exists(audio_parser.transcript_path(path))]
+    logger.info(f"书籍清单:\n{summarize_manifest(manifest)}\n"
+                f"音视频: 共{len(media)}个, 已下载{len(downloaded)}个, 已转录{len(transcribed)}个")
+
+
+def parse_args(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="U校园自动答题, 各阶段可以分开运行: 先爬取清单, 提前下载与转录, 最后答题")
+    # 子命令的覆盖参数, 未指定时使用 config.yml, 每个子命令只接受它会用到的参数
+    book = argparse.ArgumentParser(add_help=False)
+    book.add_argument('--book', help="图书ID, 覆盖 unipus.book")
+    page = argparse.ArgumentParser(add_help=False)
+    page.add_argument('--offset-page', type=int, help="从第几页开始")
+    task = argparse.ArgumentParser(add_help=False)
+    task.add_argument('--offset-tab', type=int, help="第一页从第几个栏目开始")
+    task.add_argument('--offset-task', type=int, help="第一个栏目从第几个任务开始")
+    manifest = argparse.ArgumentParser(add_help=False)
+    manifest.add_argument('--manifest', help="清单文件, 覆盖 unipus.manifest")
+
+    commands = parser.add_subparsers(dest='command')
+    crawl = commands.add_parser('crawl', parents=[book, page, manifest], help="遍历书籍生成清单, 不作答")
+    crawl.set_defaults(func=command_crawl)
+    prefetch = commands.add_parser('prefetch', parents=[book, manifest], help="按清单下载音视频, 不打开浏览器")
+    prefetch.add_argument('--workers', type=int, default=4, help="同时下载的文件数")
+    prefetch.set_defaults(func=command_prefetch)
+    transcribe = commands.add_parser('transcribe', parents=[book, manifest], help="按清单转录音视频, 不打开浏览器")
+    transcribe.add_argument('--workers', type=int, default=1,
+                            help="同时处理的文件数, 下载与提取音轨并行, 同一进程内 Whisper 一次转录一个文件")
+    transcribe.set_defaults(func=command_transcribe)
+    answer = commands.add_parser('answer', parents=[book, page, task], help="打开浏览器答题 (默认)")
+    answer.add_argument('--workers', type=int, help="并行答题的浏览器数量, 覆盖 unipus.workers")
+    answer.set_defaults(func=command_answer)
+    report = commands.add_parser('report', parents=[book, manifest], help="汇总进度日志与清单, 不打开浏览器")
+    report.set_defaults(func=command_report)
+
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or (argv[0].startswith('-') and argv[0] not in ('-h', '--help')):
+        # 不带子命令时与原来一样直接答题, 参数交给 answer
+        argv = ['answer'] + argv
+    return parser.parse_args(argv)
+
+
+def apply_overrides(args):
+    """
+    把命令行参数写入配置, 后续各模块照常从配置读取
+    """
+    for key in ('book', 'offset_page', 'offset_tab', 'offset_task'):
+        value = getattr(args, key, None)
+        if value is not None:
+            config['unipus'][key] = value
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    apply_overrides(arguments)
+    arguments.func(arguments)
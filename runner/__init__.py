@@ -1,3 +1,67 @@
+import functools
+import threading
+from typing import Callable
+
+from util.log import logger
 from util.selenium import get_driver
 
-driver = get_driver()
\ No newline at end of file
+
+class DriverProxy:
+    """
+    转发到当前浏览器的代理, 浏览器崩溃重启后各模块持有的 driver 引用无需更新
+    并行答题时每个线程可以绑定自己的浏览器; 默认浏览器在首次使用时才启动, 不需要浏览器的命令不会打开它
+    """
+
+    def __init__(self):
+        self._driver = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def current(self):
+        bound = getattr(self._local, 'driver', None)
+        if bound is not None:
+            return bound
+        with self._lock:
+            if self._driver is None:
+                self._driver = get_driver()
+        return self._driver
+
+    def bind(self, instance):
+        """
+        当前线程改用指定的浏览器, 传入 None 恢复为默认浏览器
+        """
+        self._local.driver = instance
+
+    def carry(self, func: Callable) -> Callable:
+        """
+        让在其他线程中执行的回调 (如大模型流式输出的回调) 沿用当前线程绑定的浏览器
+        """
+        bound = getattr(self._local, 'driver', None)
+        if bound is None:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            previous = getattr(self._local, 'driver', None)
+            self._local.driver = bound
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.driver = previous
+
+        return wrapper
+
+    def restart(self):
+        if self._driver is not None:
+            try:
+                self._driver.quit()
+            except Exception as e:
+                logger.debug(f"关闭浏览器失败: {e}")
+        self._driver = get_driver()
+
+    def __getattr__(self, name):
+        return getattr(self.current, name)
+
+
+driver = DriverProxy()
@@ -0,0 +1,145 @@
+import json
+import os
+import time
+from collections import Counter
+from typing import Optional
+
+from selenium.common import TimeoutException
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.wait import WebDriverWait
+
+from handler import find_handler
+from handler.page import PageModel, take_snapshot
+from runner.selenium_runner import access_page, get_page_name, wait_for_element
+from util.config import config
+from util.log import logger
+from util.selenium import click_button, find_all, find_text, wait_for_settled, is_session_alive, \
+    SESSION_ERRORS
+
+
+def count_questions(snapshot: PageModel) -> dict[str, int]:
+    """
+    统计页面中各类题目的数量, 不区分处理器
+    """
+    counts = {
+        'choices': len(snapshot.choice_questions),
+        'blanks': snapshot.count("div.comp-scoop-reply input"),
+        'inputs': len(snapshot.inputbox_questions),
+        'selections': len(snapshot.selection_questions),
+        'sortable': len(snapshot.sortable_items)
+    }
+    return {name: count for name, count in counts.items() if count}
+
+
+def crawl_task(driver, task) -> dict:
+    """
+    进入任务读取路由, 题目数量与音视频地址, 不作答也不提交
+    读取失败时把错误记录在 error 中, 不影响后面的任务; 浏览器会话断开时抛出异常
+    """
+    entry = {'name': None, 'route': None, 'questions': {}, 'audio': None, 'video': None, 'content_chars': 0,
+             'error': None}
+    try:
+        entry['name'] = task.text
+        WebDriverWait(driver, 10).until(EC.element_to_be_clickable(task)).click()
+        click_button(driver, "button.ant-btn.ant-btn-primary span", 1)
+        wait_for_element(driver, "div.layout-container", timeout=5)
+        handler = find_handler()
+        snapshot = take_snapshot(driver)
+        entry.update({
+            'route': type(handler).__name__ if handler else None,
+            'questions': count_questions(snapshot),
+            'audio': snapshot.audio_url,
+            'video': snapshot.video_url
+        })
+        if handler is not None and handler._schema is not None:
+            # 题目内容的长度 (不含音视频转录), 用于估算提示词 token
+            handler.snapshot = snapshot
+            entry['content_chars'] = len(json.dumps(handler._scrape(), ensure_ascii=False))
+    except TimeoutException:
+        logger.info("不支持处理的页面")
+    except Exception as e:
+        if isinstance(e, SESSION_ERRORS) and not is_session_alive(driver):
+            raise
+        logger.warning(f"读取任务失败: {e}")
+        entry['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        click_button(driver, "button.ant-btn.ant-btn-primary span", 0.5)
+    return entry
+
+
+def crawl_book(driver, pages: list, offset_page: int = 0, path: Optional[str] = None) -> dict:
+    """
+    遍历书籍的页面, 栏目与任务, 生成整本书的清单
+    :param driver: 驱动器, 需要已进入书籍阅读界面
+    :param pages: get_pages 返回的页面
+    :param offset_page: 从第几页开始
+    :param path: 清单文件路径, 默认为 unipus.manifest, 每爬完一页写入一次
+    :return: 清单
+    """
+    path = path or config['unipus'].get('manifest', '.cache/manifest.json')
+    manifest = {'book': config['unipus']['book'], 'created': round(time.time(), 3), 'tasks': []}
+    try:
+        for page_index in range(offset_page, len(pages)):
+            page = pages[page_index]
+            page_name = get_page_name(page)
+            logger.info(f"读取第{page_index}页: {page_name}")
+            access_page(driver, page)
+            tab_row = wait_for_element(driver, "div.ant-row.pc-tab-row", timeout=10)
+            for tab_index, tab in enumerate(find_all(tab_row, "div.tab", timeout=5)):
+                tab_name = find_text(tab, "div", timeout=5)
+                WebDriverWait(driver, 10).until(EC.element_to_be_clickable(tab)).click()
+                click_button(driver, "button.ant-btn.ant-btn-primary span", 1)
+                wait_for_element(driver, "div.layout-container", timeout=30)
+                for task_index, task in enumerate(find_all(driver, "div.pc-header-tasks-row>div", timeout=5)):
+                    entry = crawl_task(driver, task)
+                    entry.update({'position': [page_index, tab_index, task_index], 'page': page_name, 'tab': tab_name})
+                    manifest['tasks'].append(entry)
+                    logger.info(f"{page_name}-{tab_name}-Task{task_index}: {entry['route']} {entry['questions']}")
+                wait_for_settled(driver)
+            save_manifest(manifest, path)
+    finally:
+        # 中途出错时保留已读取的任务
+        save_manifest(manifest, path)
+    logger.info(f"清单已保存: {path}\n{summarize_manifest(manifest)}")
+    return manifest
+
+
+def save_manifest(manifest: dict, path: str):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+
+
+def load_manifest(path: Optional[str] = None) -> dict:
+    path = path or config['unipus'].get('manifest', '.cache/manifest.json')
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def summarize_manifest(manifest: dict) -> str:
+    """
+    按路由统计任务数, 题目数与音视频数量
+    """
+    tasks = manifest['tasks']
+    routes = Counter(task['route'] or '无处理器' for task in tasks)
+    questions = Counter()
+    for task in tasks:
+        questions.update(task['questions'])
+    media = sum(1 for task in tasks if task['audio'] or task['video'])
+    errors = sum(1 for task in tasks if task.get('error'))
+    lines = [f"共{len(tasks)}个任务, {media}个带音视频, {errors}个读取失败, "
+             f"题目内容共{sum(task['content_chars'] for task in tasks)}字符"]
+    lines.extend(f"{route}: {count}个任务" for route, count in routes.most_common())
+    lines.append(f"题目: {dict(questions)}")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    from runner import driver
+    from runner.selenium_runner import login, access_book_pages, get_pages
+
+    login(driver)
+    access_book_pages(driver)
+    crawl_book(driver, get_pages(driver), int(config['unipus']['offset_page']))
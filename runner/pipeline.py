@@ -0,0 +1,194 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from selenium.webdriver.remote.webelement import WebElement
+
+from handler import find_handler
+from handler.page import take_snapshot
+from handler.types import BaseHandler
+from runner import driver
+from runner.selenium_runner import process_task, wait_for_element
+from util import audio_parser, download
+from util.config import config
+from util.log import logger
+from util.metrics import latency
+from util.selenium import click_button
+from util.tracing import tracer
+
+
+class TaskJob:
+    """
+    流水线中的一个任务
+    """
+
+    def __init__(self, item: tuple):
+        # (任务序号, 任务元素, 任务位置, 进度位置)
+        self.item = item
+        self.task_index: int = item[0]
+        self.task: WebElement = item[1]
+        self.task_key: tuple = item[2]
+        self.handler: Optional[BaseHandler] = None
+        self.media_url: Optional[str] = None
+        self.media_path: Optional[str] = None
+        self.video = False
+        # 与顺序执行时一致的任务名, 用于追踪
+        self.label = f"{self.task_key[1]}-{self.task_key[2]}-Task{self.task_index}"
+
+
+class Stage:
+    """
+    流水线的一个阶段: 若干个工作协程从有界队列中取出任务, 在独立线程池中执行后交给下一阶段
+    队列满时上一阶段等待, 形成背压
+    """
+
+    def __init__(self, name: str, func: Callable[[TaskJob], None], workers: int, capacity: int,
+                 output: Optional[asyncio.Queue] = None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=capacity)
+        self.output = output
+        self.busy = 0.0
+        self.count = 0
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+    def _call(self, func: Callable[[TaskJob], None], job: TaskJob):
+        with tracer.task(job.label):
+            with tracer.span(f"stage.{self.name}"):
+                func(job)
+
+    async def run_job(self, job: TaskJob, func: Optional[Callable[[TaskJob], None]] = None, propagate=False):
+        """
+        :param propagate: 是否抛出异常, 否则只记录日志
+        """
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            await loop.run_in_executor(self.executor, self._call, func or self.func, job)
+        except Exception as e:
+            if propagate:
+                raise
+            # 提前处理失败时任务照常向后传递, 作答时按原来的方式处理
+            logger.warning(f"流水线阶段{self.name}处理第{job.task_index}个任务失败: {e}")
+        finally:
+            elapsed = time.perf_counter() - start
+            self.busy += elapsed
+            self.count += 1
+            latency.record(f"stage.{self.name}", elapsed)
+
+    async def work(self):
+        while True:
+            job = await self.queue.get()
+            await self.run_job(job)
+            if self.output is not None:
+                await self.output.put(job)
+
+    def utilization(self, wall: float) -> str:
+        usage = self.busy / (wall * self.workers) if wall > 0 else 0.0
+        return f"{self.name}: {usage:.0%} ({self.count}项, {self.workers}个并发)"
+
+
+class TaskPipeline:
+    """
+    单个栏目内的任务流水线
+    浏览器阶段串行执行: 提前进入后面的任务读取题目, 答案就绪后回到该任务填写并提交
+    下载, 转录与大模型提问在各自的阶段中与浏览器同时进行
+    """
+
+    def __init__(self, items: list[tuple], finish: Callable[[tuple, str, Optional[float]], None]):
+        settings = config['unipus'].get('pipeline', {})
+        self.jobs = [TaskJob(item) for item in items]
+        self.finish = finish
+        self.lookahead = max(1, int(settings.get('lookahead', 3)))
+        capacity = self.lookahead
+        self.ready: asyncio.Queue = asyncio.Queue()
+        self.llm = Stage("llm", self._prepare, int(settings.get('llm_workers', 3)), capacity, self.ready)
+        self.transcribe = Stage("transcribe", self._transcribe, int(settings.get('transcribe_workers', 1)),
+                                capacity, self.llm.queue)
+        self.fetch = Stage("fetch", self._fetch, int(settings.get('fetch_workers', 2)), capacity,
+                           self.transcribe.queue)
+        self.browser = Stage("browser", self._answer, 1, 1)
+        # 浏览器阶段在固定线程中执行, 沿用调用方线程绑定的浏览器
+        self.browser.executor.shutdown()
+        self.browser.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="browser",
+                                                   initializer=driver.bind, initargs=(driver.current,))
+
+    def _scan(self, job: TaskJob):
+        logger.info(f"预读第{job.task_index}个任务: {job.task.text}")
+        job.task.click()
+        click_button(driver, "button.ant-btn.ant-btn-primary span", 1)
+        wait_for_element(driver, "div.layout-container", timeout=5)
+        handler = find_handler()
+        if handler is None:
+            return
+        handler.reset(job.task_key)
+        handler.snapshot = take_snapshot(driver)
+        job.handler = handler
+        job.media_url = handler.snapshot.audio_url or handler.snapshot.video_url
+        job.video = job.media_url is not None and job.media_url == handler.snapshot.video_url
+        click_button(driver, "button.ant-btn.ant-btn-primary span", 0.5)
+
+    def _answer(self, job: TaskJob):
+        status, score = process_task(driver, job.task, job.task_index, task_key=job.task_key,
+                                     prepared=job.handler)
+        self.finish(job.item, status, score)
+
+    @staticmethod
+    def _fetch(job: TaskJob):
+        if job.media_url:
+            job.media_path = download.download_file(job.media_url)
+
+    @staticmethod
+    def _transcribe(job: TaskJob):
+        if job.media_path:
+            if job.video:
+                audio_parser.from_video(job.media_path)
+            else:
+                audio_parser.from_audio(job.media_path)
+
+    @staticmethod
+    def _prepare(job: TaskJob):
+        if job.handler is not None:
+            job.handler.prepare()
+
+    async def _drive_browser(self):
+        scanned = 0
+        answered = 0
+        while answered < len(self.jobs):
+            if self.ready.empty() and scanned < len(self.jobs) and scanned - answered < self.lookahead:
+                job = self.jobs[scanned]
+                scanned += 1
+                await self.browser.run_job(job, self._scan)
+                await self.fetch.queue.put(job)
+            else:
+                job = await self.ready.get()
+                # 作答时的错误与顺序执行时一样向上抛出, 浏览器崩溃时由上层重启
+                await self.browser.run_job(job, propagate=True)
+                answered += 1
+
+    async def run(self):
+        stages = [self.fetch, self.transcribe, self.llm]
+        workers = [asyncio.create_task(stage.work()) for stage in stages for _ in range(stage.workers)]
+        start = time.perf_counter()
+        try:
+            await self._drive_browser()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            for stage in stages + [self.browser]:
+                stage.executor.shutdown(wait=False)
+        wall = time.perf_counter() - start
+        logger.info(f"流水线完成{len(self.jobs)}个任务, 耗时{wall:.1f}秒, 阶段利用率: "
+                    + ', '.join(stage.utilization(wall) for stage in [self.browser] + stages))
+
+
+def run_pipeline(items: list[tuple], finish: Callable[[tuple, str, Optional[float]], None]):
+    """
+    以流水线方式完成一个栏目内的任务
+    :param items: [(任务序号, 任务元素, 任务位置, 进度位置)]
+    :param finish: 每个任务提交后的回调, 参数为 (任务, 状态, 分数)
+    """
+    asyncio.run(TaskPipeline(items, finish).run())
@@ -1,5 +1,4 @@
 import time
-from time import sleep
 from typing import Optional
 
 from selenium.common import TimeoutException, NoSuchElementException
@@ -10,8 +9,11 @@ from selenium.webdriver.support.wait import WebDriverWait
 
 from handler import find_handler
 from util.config import config
+from util.journal import journal, FINISHED, FAILED, SKIPPED
 from util.log import logger
-from util.selenium import click_button
+from util.tracing import tracer
+from util.selenium import click_button, wait_for_settled, find_all, find_text, open_page, is_session_alive, \
+    record_navigation
 
 
 def login(driver, username: Optional[str] = None, password: Optional[str] = None):
@@ -20,10 +22,16 @@ def login(driver, username: Optional[str] = None, password: Optional[str] = None
         username = config['unipus']['username']
     if not password:
         password = config['unipus']['password']
-    driver.get("https://ucloud.unipus.cn/sso/index.html?service=https%3A%2F%2Fucloud.unipus.cn%2Fhome")
-    username_field = WebDriverWait(driver, 10).until(
-        EC.presence_of_element_located((By.ID, "username"))
+    open_page(driver, "https://ucloud.unipus.cn/sso/index.html?service=https%3A%2F%2Fucloud.unipus.cn%2Fhome")
+    # 复用浏览器用户数据时, 已有的登录会话会直接跳转到首页
+    WebDriverWait(driver, 10).until(
+        lambda d: "/sso/" not in d.current_url or d.find_elements(By.ID, "username")
     )
+    if "/sso/" not in driver.current_url:
+        logger.info("已有登录会话, 跳过登录")
+        wait_for_settled(driver)
+        return
+    username_field = driver.find_element(By.ID, "username")
     password_field = driver.find_element(By.ID, "password")
     logger.info(f"登录账户: {username}")
     username_field.send_keys(username)
@@ -34,57 +42,118 @@ def login(driver, username: Optional[str] = None, password: Optional[str] = None
 
     login_button = driver.find_element(By.CSS_SELECTOR, "button.usso-login-btn")
     login_button.click()
-    sleep(1)
+    try:
+        WebDriverWait(driver, 10).until(lambda d: "/sso/" not in d.current_url)
+    except TimeoutException:
+        logger.warning("登录后未跳转, 请检查账号密码")
+    wait_for_settled(driver)
 
 def access_book_pages(driver, book: Optional[str] = None):
     if not book:
         book = config['unipus']['book']
     logger.info(f"准备书籍{book}阅读界面")
-    driver.get(f"https://ucloud.unipus.cn/app/cmgt/resource-detail/{book}")
-    time.sleep(1)
+    open_page(driver, f"https://ucloud.unipus.cn/app/cmgt/resource-detail/{book}")
+    wait_for_settled(driver)
     click_button(driver, "button.ant-btn.ant-btn-default.courses-info_buttonLayer1__Mtel4 span")
-    click_button(driver,"div.know-box span.iKnow")
-    click_button(driver,"button.ant-btn.ant-btn-primary span")
+    wait_for_settled(driver)
+    # 提示弹窗在复用的会话中可能已被关闭过, 不再出现, 只短暂等待
+    click_button(driver,"div.know-box span.iKnow", 5)
+    click_button(driver,"button.ant-btn.ant-btn-primary span", 5)
     logger.info(f"成功进入书籍{book}阅读界面")
-    time.sleep(0.2)
+    wait_for_settled(driver)
 
 def get_pages(driver) -> list[WebElement]:
     return WebDriverWait(driver, 30).until(
         EC.presence_of_all_elements_located((By.CSS_SELECTOR, "div.pc-slider-menu-micro"))
     )
 
+def get_page_name(page: WebElement) -> str:
+    return find_text(page, "span.pc-menu-node-name", timeout=5)
+
 def access_page(driver, page: WebElement):
-    page_name = page.find_element(By.CSS_SELECTOR, "span.pc-menu-node-name").text
+    page_name = get_page_name(page)
     logger.info(f"进入{page_name}页面")
+    start = time.perf_counter()
     page.click()
     click_button(driver,"button.ant-btn.ant-btn-primary span")
-    time.sleep(0.2)
+    wait_for_settled(driver)
+    record_navigation("navigate.page", start)
+
+
+# 读取栏目或任务的完成状态: 元素自身或子元素的类名与完成标记完全一致 (或匹配配置的选择器) 即为已完成,
+# 分数取带分数标记的元素中的数字
+_COMPLETION_SCRIPT = """
+const [elements, doneMarks, scoreMarks, doneSelector] = arguments;
+const hasMark = (node, marks) => Array.from(node.classList || []).some(name => marks.includes(name.toLowerCase()));
+return elements.map(element => {
+    const nodes = [element, ...element.querySelectorAll('*')];
+    const scoreNode = nodes.find(node => hasMark(node, scoreMarks));
+    const match = scoreNode ? scoreNode.textContent.match(/\\d+(\\.\\d+)?/) : null;
+    const done = doneSelector ? nodes.some(node => node.matches(doneSelector))
+        : nodes.some(node => hasMark(node, doneMarks));
+    return {done: done, score: match ? parseFloat(match[0]) : null};
+});
+"""
+
+
+def get_completed(driver, elements: list[WebElement]) -> list[Optional[float]]:
+    """
+    一次脚本调用判断栏目或任务是否已完成且无需重做, 有完成标记但没有分数时视为未达到最低分数
+    :return: 与元素一一对应, 无需重做时为分数 (min_score 为 0 且没有分数时为 -1), 需要作答时为 None
+    """
+    completion = config['unipus'].get('completion', {})
+    if not elements or not completion.get('skip_done', True):
+        return [None] * len(elements)
+    states = driver.execute_script(
+        _COMPLETION_SCRIPT,
+        elements,
+        [mark.lower() for mark in completion.get('done_classes', ['finished', 'complete', 'completed', 'done'])],
+        [mark.lower() for mark in completion.get('score_classes', ['score', 'grade'])],
+        completion.get('done_selector') or None
+    )
+    min_score = float(completion.get('min_score', 60))
+    completed = []
+    for state in states:
+        if not state['done']:
+            completed.append(None)
+        elif state['score'] is not None:
+            completed.append(state['score'] if state['score'] >= min_score else None)
+        else:
+            completed.append(-1 if min_score <= 0 else None)
+    return completed
 
 
-def auto_answer_questions(driver, page_name, offset_tab, offset_task):
+def auto_answer_questions(driver, page_name, offset_tab, offset_task, page_index=0):
     """
     自动答题核心模块
     :param driver: 驱动器
     :param page_name: 页名
     :param offset_tab 偏移标签
-    :param offset_task 便宜任务
+    :param offset_task 便宜任务, 只作用于第一个栏目
+    :param page_index 页面在书籍中的序号, 用于记录进度
     :return: 答题失败的集合 (不包括检测不到处理器的)
     """
+    book = config['unipus']['book']
     failed_questions = set()
     logger.info(f"开始回答页面{page_name}的问题")
 
     # 定位并获取所有标签页
-    tab_row = driver.find_element(By.CSS_SELECTOR, "div.ant-row.pc-tab-row")
-    tabs = tab_row.find_elements(By.CSS_SELECTOR, "div.tab")[offset_tab:]
+    tab_row = wait_for_element(driver, "div.ant-row.pc-tab-row", timeout=10)
+    tabs = find_all(tab_row, "div.tab", timeout=5)[offset_tab:]
+    tabs_completed = get_completed(driver, tabs)
     logger.info(f"检测到页面共有{len(tabs)}个栏目, 开始遍历")
 
     # 遍历每个标签页
     for tab_index, tab in enumerate(tabs):
-        tab_name = tab.find_element(By.TAG_NAME, "div").text
+        tab_name = find_text(tab, "div", timeout=5)
+        if tabs_completed[tab_index] is not None:
+            logger.info(f"跳过已完成的第{tab_index}个栏目: {tab_name}")
+            continue
         logger.info(f"进入第{tab_index}个栏目: {tab_name}")
         clickable_tab = WebDriverWait(driver, 10).until(
             EC.element_to_be_clickable(tab)
         )
+        start = time.perf_counter()
         clickable_tab.click()
 
         # 点击进入标签页的按钮
@@ -92,29 +161,61 @@ def auto_answer_questions(driver, page_name, offset_tab, offset_task):
 
         # 等待页面加载
         wait_for_element(driver, "div.layout-container", timeout=30)
+        record_navigation("navigate.tab", start)
 
         # 获取当前标签页下的所有任务
-        tasks = driver.find_elements(By.CSS_SELECTOR, "div.pc-header-tasks-row>div")[offset_task:]
-        logger.info(f"页面共有{len(tasks)}个任务, 开始遍历")
+        first_task = offset_task if tab_index == 0 else 0
+        tasks = find_all(driver, "div.pc-header-tasks-row>div", timeout=5)[first_task:]
+        tasks_completed = get_completed(driver, tasks)
+        logger.info(f"页面共有{len(tasks)}个任务, 其中{sum(done is not None for done in tasks_completed)}个已完成, 开始遍历")
 
-        # 遍历每个任务
+        # 遍历每个任务, 跳过已完成的
+        pending = []
         for task_index, task in enumerate(tasks):
-            task_result = process_task(driver, task, task_index)
-            if not task_result:
-                failed_questions.add(f"{page_name}-{tab_name}-Task{task_index}")
+            task_key = (book, page_name, tab_name, first_task + task_index)
+            position = (page_index, offset_tab + tab_index, first_task + task_index)
+            if journal and journal.is_done(book, position):
+                logger.info(f"进度日志中第{task_index}个任务已完成, 跳过")
+                continue
+            if tasks_completed[task_index] is not None:
+                logger.info(f"跳过已完成的第{task_index}个任务: {task.text}")
+                score = tasks_completed[task_index]
+                if journal:
+                    journal.record(book, position, (page_name, tab_name), SKIPPED, score if score >= 0 else None)
+                continue
+            pending.append((task_index, task, task_key, position))
+
+        def finish(item: tuple, status: str, score: Optional[float]):
+            if status == FAILED:
+                failed_questions.add(f"{page_name}-{tab_name}-Task{item[0]}")
+            if journal:
+                journal.record(book, item[3], (page_name, tab_name), status, score)
 
             # 任务间等待
-            time.sleep(float(config['unipus']['task_wait']))
+            wait_for_settled(driver, min_delay=float(config['unipus'].get('task_wait', 0)))
+
+        if config['unipus'].get('pipeline', {}).get('enabled') and len(pending) > 1:
+            from runner.pipeline import run_pipeline
+            run_pipeline(pending, finish)
+        else:
+            for item in pending:
+                with tracer.task(f"{page_name}-{tab_name}-Task{item[0]}"):
+                    finish(item, *process_task(driver, item[1], item[0], task_key=item[2]))
 
         # 标签页间等待
-        time.sleep(float(config['unipus']['tab_wait']))
+        wait_for_settled(driver, min_delay=float(config['unipus'].get('tab_wait', 0)))
 
     logger.info("本页任务全部完成!")
     return failed_questions
 
 
-def process_task(driver, task, task_index, max_retries=2):
-    """处理单个任务，支持重试机制"""
+def process_task(driver, task, task_index, max_retries=2, task_key=None,
+                 prepared=None) -> tuple[str, Optional[float]]:
+    """
+    处理单个任务，支持重试机制
+    :param prepared: 流水线中提前提问的处理器, 首次作答时沿用它的答案
+    :return: (任务状态, 分数), 浏览器会话断开时抛出异常
+    """
     for retry in range(max_retries + 1):
         if retry > 0:
             logger.info(f"进入第{task_index}个任务: {task.text} (Retry {retry})")
@@ -125,45 +226,56 @@ def process_task(driver, task, task_index, max_retries=2):
         clickable_task = WebDriverWait(driver, 10).until(
             EC.element_to_be_clickable(task)
         )
+        start = time.perf_counter()
         clickable_task.click()
         click_button(driver, "button.ant-btn.ant-btn-primary span", 1)
 
         try:
             # 等待页面加载
             wait_for_element(driver, "div.layout-container", timeout=5)
+            record_navigation("navigate.task", start)
 
             # 查找处理器
             handler = find_handler()
             if not handler:
                 logger.info("找不到适合的处理器")
-                return False
+                return SKIPPED, None
+            handler.reset(task_key)
+            if prepared is not None and retry == 0:
+                handler.adopt(prepared)
 
             # 处理问题
             if handler.handle():
                 logger.info("做题完成，进入下一题")
-                return True
+                return FINISHED, handler.score
             elif retry < max_retries:
                 # 如果处理失败且还有重试次数，继续下一次重试
                 continue
             else:
                 logger.info("做题失败")
-                return False
+                return FAILED, handler.score
 
-        except TimeoutException:
-            logger.info("不支持处理的页面")
-            return False
+        except TimeoutException as e:
+            # 页面加载或作答中的等待超时按失败处理, 进度日志恢复时会重做
+            logger.warning(f"等待页面元素超时: {e.msg}")
+            if retry == max_retries:
+                return FAILED, None
         except Exception as e:
+            if not is_session_alive(driver):
+                # 浏览器会话已断开, 交给上层重启浏览器
+                raise
             logger.warning(f"处理问题时遇到错误", exc_info=e)
             if retry == max_retries:
-                return False
+                return FAILED, None
         finally:
             # 确保处理完成
             click_button(driver, "button.ant-btn.ant-btn-primary span", 0.5)
 
 
-    return False
+    return FAILED, None
 
 
+@tracer.traced("wait.element")
 def wait_for_element(driver, css_selector, timeout=10):
     """等待元素出现的封装函数"""
     return WebDriverWait(driver, timeout).until(
@@ -0,0 +1,153 @@
+import queue
+import threading
+import time
+
+
+from runner import driver
+from runner.selenium_runner import access_book_pages, get_pages, get_page_name, access_page, auto_answer_questions
+from util.config import config
+from util.log import logger
+from util.selenium import get_driver, is_session_alive, wait_for_settled, SESSION_ERRORS
+
+# Network.setCookies 接受的 Cookie 字段
+_COOKIE_FIELDS = ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite')
+
+
+def share_cookies(source, target):
+    """
+    把已登录浏览器的全部 Cookie (含单点登录的域名) 复制到新浏览器
+    """
+    cookies = []
+    for cookie in source.execute_cdp_cmd('Network.getAllCookies', {})['cookies']:
+        param = {field: cookie[field] for field in _COOKIE_FIELDS if field in cookie}
+        if not cookie.get('session') and cookie.get('expires', -1) > 0:
+            param['expires'] = cookie['expires']
+        cookies.append(param)
+    target.execute_cdp_cmd('Network.enable', {})
+    target.execute_cdp_cmd('Network.setCookies', {'cookies': cookies})
+
+
+class PoolReport:
+    """
+    汇总各个浏览器的答题进度
+    """
+
+    def __init__(self, total: int):
+        self.total = total
+        self.failed_questions: set[str] = set()
+        self.pages: dict[str, list[int]] = {}
+        self.errors: list[int] = []
+        self._lock = threading.Lock()
+
+    def page_done(self, worker: str, page_index: int, failed_questions: set[str]):
+        with self._lock:
+            self.pages.setdefault(worker, []).append(page_index)
+            self.failed_questions |= failed_questions
+            done = sum(len(pages) for pages in self.pages.values())
+        logger.info(f"第{page_index}页完成, 进度: {done}/{self.total}")
+
+    def page_error(self, page_index: int):
+        with self._lock:
+            self.errors.append(page_index)
+
+    def summary(self) -> str:
+        with self._lock:
+            lines = [f"{worker}: 完成{len(pages)}页 {sorted(pages)}" for worker, pages in sorted(self.pages.items())]
+            if self.errors:
+                lines.append(f"出错的页面: {sorted(self.errors)}")
+        return '\n'.join(lines)
+
+
+class PageWorker(threading.Thread):
+    """
+    使用独立浏览器答题的工作线程, 从共享队列中逐个领取页面
+    """
+
+    def __init__(self, name: str, pages: queue.Queue, report: PoolReport, max_restarts: int):
+        super().__init__(name=name, daemon=True)
+        self.pages = pages
+        self.report = report
+        self.max_restarts = max_restarts
+        self.browser = None
+
+    def _start_browser(self):
+        if self.browser is not None:
+            try:
+                self.browser.quit()
+            except Exception as e:
+                logger.debug(f"关闭浏览器失败: {e}")
+        self.browser = get_driver(persistent=False)
+        # 从默认浏览器复制登录状态
+        driver.bind(None)
+        share_cookies(driver.current, self.browser)
+        driver.bind(self.browser)
+        access_book_pages(driver)
+
+    def run(self):
+        restarts = 0
+        try:
+            self._start_browser()
+            while True:
+                try:
+                    page_index, offset_tab, offset_task = self.pages.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    page = get_pages(driver)[page_index]
+                    access_page(driver, page)
+                    failed_questions = auto_answer_questions(
+                        driver=driver,
+                        page_name=get_page_name(page),
+                        offset_tab=offset_tab,
+                        offset_task=offset_task,
+                        page_index=page_index
+                    )
+                    self.report.page_done(self.name, page_index, failed_questions)
+                    wait_for_settled(driver, min_delay=float(config['unipus'].get('page_wait', 0)))
+                except SESSION_ERRORS as e:
+                    if is_session_alive(driver) or restarts >= self.max_restarts:
+                        logger.error(f"第{page_index}页答题出错", exc_info=e)
+                        self.report.page_error(page_index)
+                        continue
+                    # 浏览器崩溃时重启, 页面放回队列, 已完成的任务由进度日志跳过
+                    restarts += 1
+                    logger.warning(f"浏览器会话断开, 重启后重做第{page_index}页 ({restarts}/{self.max_restarts})")
+                    self.pages.put((page_index, offset_tab, offset_task))
+                    self._start_browser()
+        except Exception as e:
+            logger.error("工作线程异常退出", exc_info=e)
+        finally:
+            driver.bind(None)
+            if self.browser is not None:
+                try:
+                    self.browser.quit()
+                except Exception as e:
+                    logger.debug(f"关闭浏览器失败: {e}")
+
+
+def answer_pages_parallel(page_count: int, offsets: tuple[int, int, int], workers: int) -> set[str]:
+    """
+    多个浏览器并行答题, 需要默认浏览器已登录
+    :param page_count: 书籍的页面数
+    :param offsets: (页面偏移, 栏目偏移, 任务偏移), 栏目与任务偏移只作用于第一页
+    :param workers: 浏览器数量
+    :return: 答题失败的任务
+    """
+    offset_page, offset_tab, offset_task = offsets
+    pages = queue.Queue()
+    for page_index in range(offset_page, page_count):
+        first = page_index == offset_page
+        pages.put((page_index, offset_tab if first else 0, offset_task if first else 0))
+    report = PoolReport(pages.qsize())
+    workers = max(1, min(workers, pages.qsize()))
+    logger.info(f"使用{workers}个浏览器并行答题, 共{pages.qsize()}页")
+
+    start = time.perf_counter()
+    max_restarts = int(config['selenium'].get('max_restarts', 3))
+    threads = [PageWorker(f"worker-{index}", pages, report, max_restarts) for index in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    logger.info(f"并行答题完成, 耗时{time.perf_counter() - start:.1f}秒\n{report.summary()}")
+    return report.failed_questions
@@ -0,0 +1,62 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Optional
+
+from util.config import config
+from util.log import logger
+
+
+def fingerprint(content) -> str:
+    """
+    计算抓取内容的指纹, 题目内容变化时指纹随之变化
+    """
+    payload = json.dumps(content, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+class AnswerStore:
+    """
+    已验证答案库, 保存分数达标的答案, 重跑同一本书时直接填写
+    以 JSONL 追加写入, 同一键以最后一次写入为准
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._answers: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    line = line.strip()
+                    if line:
+                        item = json.loads(line)
+                        self._answers[item['key']] = item
+            logger.info(f"加载已验证答案{len(self._answers)}条: {path}")
+
+    @staticmethod
+    def make_key(task_key: tuple, content) -> str:
+        """
+        :param task_key: (图书, 页面, 栏目, 任务序号)
+        :param content: 抓取的题目内容
+        """
+        return '|'.join(str(part) for part in task_key) + f"|{fingerprint(content)}"
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._answers.get(key)
+        return item['answer'] if item else None
+
+    def put(self, key: str, schema: str, answer: dict, score: float):
+        item = {'key': key, 'schema': schema, 'answer': answer, 'score': score}
+        with self._lock:
+            self._answers[key] = item
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(item, ensure_ascii=False) + '\n')
+
+
+answer_store = AnswerStore(config['unipus']['answer_store']) if config['unipus'].get('answer_store') else None
@@ -1,14 +1,19 @@
 import torch
 import whisper
 import os
+import threading
 from moviepy import VideoFileClip
 
 from util.log import logger
+from util.tracing import tracer
 
 path_to_video_cache = {}
 path_to_audio_cache = {}
+# 多个浏览器并行答题时, 同一个 Whisper 模型一次只转录一个文件
+_transcribe_lock = threading.Lock()
 
 
+@tracer.traced("transcribe.video")
 def from_video(video_path: str) -> str:
     if video_path in path_to_video_cache:
         logger.info(f"使用视频缓存: {video_path}")
@@ -29,7 +34,8 @@ def from_video(video_path: str) -> str:
             if video.audio is None:
                 raise ValueError(f"视频文件没有音频轨道: {video_path}")
 
-            video.audio.write_audiofile(audio_path, logger=None)
+            with tracer.span("transcribe.extract", path=video_path):
+                video.audio.write_audiofile(audio_path, logger=None)
         text = from_audio(audio_path)
         path_to_video_cache[video_path] = text
         logger.info(f"视频转录完成: {video_path}")
@@ -44,31 +50,50 @@ def from_video(video_path: str) -> str:
             video.close()
 
 
+def transcript_path(audio_path: str, language_t: str = "en") -> str:
+    """
+    转录文本保存在音频文件旁边, 提前转录后答题时直接读取
+    """
+    return f"{os.path.splitext(audio_path)[0]}.{language_t}.txt"
+
+
+@tracer.traced("transcribe.audio")
 def from_audio(audio_path: str, language_t: str = "en") -> str:
     cache_key = f"{audio_path}_{language_t}"
     if cache_key in path_to_audio_cache:
         logger.info(f"使用音频缓存: {audio_path}")
         return path_to_audio_cache[cache_key]
 
+    text_path = transcript_path(audio_path, language_t)
+    if os.path.exists(text_path):
+        logger.info(f"使用转录文件: {text_path}")
+        with open(text_path, 'r', encoding='utf-8') as file:
+            text = file.read()
+        path_to_audio_cache[cache_key] = text
+        return text
+
     if not os.path.exists(audio_path):
         raise FileNotFoundError(f"音频文件不存在: {audio_path}")
 
     try:
         device = "cuda" if torch.cuda.is_available() else "cpu"
-        model = load_whisper_model(device)
-
         fp16 = device == "cuda"
 
-        logger.info(f"开始转录音频: {audio_path}, 语言: {language_t}")
-        result = model.transcribe(
-            audio_path,
-            language=language_t if language_t != "auto" else None,
-            fp16=fp16,
-            verbose=False
-        )
+        with _transcribe_lock:
+            model = load_whisper_model(device)
+            logger.info(f"开始转录音频: {audio_path}, 语言: {language_t}")
+            with tracer.span("transcribe.whisper", path=audio_path, device=device):
+                result = model.transcribe(
+                    audio_path,
+                    language=language_t if language_t != "auto" else None,
+                    fp16=fp16,
+                    verbose=False
+                )
 
         text = result["text"].strip()
 
+        with open(text_path, 'w', encoding='utf-8') as file:
+            file.write(text)
         path_to_audio_cache[cache_key] = text
         logger.info(f"音频转录完成: {audio_path}, 文本长度: {len(text)}")
 
@@ -5,6 +5,7 @@ import hashlib
 from urllib.parse import urlparse
 
 from util.log import logger
+from util.tracing import tracer
 
 
 def get_url_hash(url: str) -> str:
@@ -37,6 +38,36 @@ def get_file_extension_from_url(url: str) -> str:
     return ""
 
 
+def get_cache_path(url: str, save_dir: str = ".cache", force_extension: str = None) -> str:
+    """
+    根据URL得到缓存文件的路径, 不检查文件是否存在
+
+    Args:
+        url: 下载链接
+        save_dir: 文件保存目录，默认为 .cache
+        force_extension: 强制指定文件扩展名（可选）
+
+    Returns:
+        str: 缓存文件的本地路径
+    """
+    # 使用URL哈希值作为文件名
+    url_hash = get_url_hash(url)
+
+    # 确定文件扩展名
+    if force_extension:
+        extension = force_extension
+    else:
+        extension = get_file_extension_from_url(url)
+
+    # 生成文件名
+    if extension:
+        file_name = f"{url_hash}.{extension}"
+    else:
+        file_name = url_hash
+    return os.path.join(save_dir, file_name)
+
+
+@tracer.traced("download")
 def download_file(url: str, save_dir: str = ".cache", custom_filename: str = None,
                   force_extension: str = None) -> str:
     """
@@ -56,24 +87,10 @@ def download_file(url: str, save_dir: str = ".cache", custom_filename: str = Non
 
     # 确定文件名
     if custom_filename:
-        file_name = custom_filename
+        save_path = os.path.join(save_dir, custom_filename)
     else:
-        # 使用URL哈希值作为文件名
-        url_hash = get_url_hash(url)
-
-        # 确定文件扩展名
-        if force_extension:
-            extension = force_extension
-        else:
-            extension = get_file_extension_from_url(url)
-
-        # 生成文件名
-        if extension:
-            file_name = f"{url_hash}.{extension}"
-        else:
-            file_name = url_hash
-
-    save_path = os.path.join(save_dir, file_name)
+        save_path = get_cache_path(url, save_dir, force_extension)
+    file_name = os.path.basename(save_path)
 
     # 如果文件已存在，直接返回
     if os.path.exists(save_path):
@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from util.config import config
+from util.log import logger
+
+# 任务状态
+FINISHED = "finished"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class ProgressJournal:
+    """
+    答题进度日志, 每完成一个任务追加一行, 启动时从最后一个任务之后继续
+    位置为 (页面序号, 栏目序号, 任务序号), 均为在书籍中的绝对序号
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: list[dict] = []
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    line = line.strip()
+                    if line:
+                        self._entries.append(json.loads(line))
+            logger.info(f"加载进度日志{len(self._entries)}条: {path}")
+
+    def record(self, book: str, position: tuple[int, int, int], names: tuple[str, str], status: str,
+               score: Optional[float] = None):
+        """
+        :param book: 图书ID
+        :param position: (页面序号, 栏目序号, 任务序号)
+        :param names: (页面名, 栏目名)
+        :param status: finished, failed 或 skipped
+        :param score: 提交后的分数
+        """
+        entry = {
+            'book': book,
+            'position': list(position),
+            'page': names[0],
+            'tab': names[1],
+            'status': status,
+            'score': score,
+            'time': round(time.time(), 3)
+        }
+        with self._lock:
+            self._entries.append(entry)
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def resume_position(self, book: str) -> Optional[tuple[int, int, int]]:
+        """
+        继续答题的位置: 最后一次记录仍为失败的第一个任务, 没有失败的任务时为最后记录的任务之后
+        :return: (页面序号, 栏目序号, 任务序号), 没有记录时返回 None
+        """
+        latest = self.latest(book)
+        if not latest:
+            return None
+        for position, entry in latest.items():
+            if entry['status'] not in (FINISHED, SKIPPED):
+                return position
+        page_index, tab_index, task_index = max(latest)
+        return page_index, tab_index, task_index + 1
+
+    def is_done(self, book: str, position: tuple[int, int, int]) -> bool:
+        """
+        该任务最后一次记录是否为已完成或已跳过
+        """
+        with self._lock:
+            statuses = [entry['status'] for entry in self._entries
+                        if entry['book'] == book and tuple(entry['position']) == tuple(position)]
+        return bool(statuses) and statuses[-1] in (FINISHED, SKIPPED)
+
+    def latest(self, book: str) -> dict[tuple, dict]:
+        """
+        本书每个任务的最后一次记录, 按位置排序
+        """
+        latest = {}
+        with self._lock:
+            for entry in self._entries:
+                if entry['book'] == book:
+                    latest[tuple(entry['position'])] = entry
+        return dict(sorted(latest.items()))
+
+    def failed_tasks(self, book: str) -> list[str]:
+        """
+        本书最后一次记录仍为失败的任务
+        """
+        return [f"{entry['page']}-{entry['tab']}-Task{entry['position'][2]}"
+                for entry in self.latest(book).values() if entry['status'] == FAILED]
+
+    def summarize(self, book: str) -> str:
+        """
+        按状态统计本书的任务数与平均分数
+        """
+        entries = list(self.latest(book).values())
+        if not entries:
+            return f"{book}: 没有进度记录"
+        lines = [f"{book}: 共记录{len(entries)}个任务, 最后位置{list(entries[-1]['position'])}"]
+        for status in (FINISHED, FAILED, SKIPPED):
+            matched = [entry for entry in entries if entry['status'] == status]
+            scores = [entry['score'] for entry in matched if entry['score'] is not None]
+            average = f", 平均分数{sum(scores) / len(scores):.1f}" if scores else ''
+            lines.append(f"{status}: {len(matched)}个{average}")
+        return '\n'.join(lines)
+
+
+journal = ProgressJournal(config['unipus']['journal']) if config['unipus'].get('journal') else None
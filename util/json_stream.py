@@ -0,0 +1,111 @@
+import json
+from typing import Any, Iterable, Optional
+
+
+class JsonArrayStreamParser:
+    """
+    增量JSON解析器
+    用于流式输出: 逐段喂入JSON文本, 每当顶层对象中某个数组字段的元素解析完成时立即取出,
+    无需等待整个JSON结束
+    """
+
+    def __init__(self, fields: Optional[Iterable[str]] = None):
+        """
+        :param fields: 需要取出元素的数组字段名, 为空则取出顶层对象中所有数组字段的元素
+        """
+        self.fields = set(fields) if fields else None
+        self._buffer = ''
+        self._pos = 0
+        self._stack: list[str] = []
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key_start = -1
+        self._key: Optional[str] = None
+        self._field: Optional[str] = None
+        self._item_start = -1
+        self._item_index = 0
+
+    @property
+    def text(self) -> str:
+        return self._buffer
+
+    def feed(self, text: str) -> list[tuple[str, int, Any]]:
+        """
+        喂入一段JSON文本
+        :return: 本次新解析完成的元素列表, 每项为 (字段名, 元素序号, 元素值)
+        """
+        self._buffer += text
+        items = []
+        while self._pos < len(self._buffer):
+            self._consume(self._buffer[self._pos], items)
+            self._pos += 1
+        return items
+
+    def _in_target_array(self) -> bool:
+        return self._field is not None and len(self._stack) == 2
+
+    def _emit(self, end: int, items: list):
+        raw = self._buffer[self._item_start:end].strip()
+        self._item_start = -1
+        try:
+            items.append((self._field, self._item_index, json.loads(raw)))
+        except json.JSONDecodeError:
+            return
+        self._item_index += 1
+
+    def _consume(self, ch: str, items: list):
+        pos = self._pos
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == '\\':
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                if self._key_start >= 0:
+                    self._key = json.loads(self._buffer[self._key_start:pos + 1])
+                    self._key_start = -1
+                elif self._in_target_array() and self._item_start >= 0:
+                    # 字符串元素在引号闭合时即可取出
+                    self._emit(pos + 1, items)
+            return
+
+        if ch == '"':
+            self._in_string = True
+            if len(self._stack) == 1 and self._expect_key:
+                self._key_start = pos
+            elif self._in_target_array() and self._item_start < 0:
+                self._item_start = pos
+        elif ch in '{[':
+            if self._in_target_array() and self._item_start < 0:
+                self._item_start = pos
+            if ch == '[' and len(self._stack) == 1 and (self.fields is None or self._key in self.fields):
+                self._field = self._key
+                self._item_index = 0
+                self._item_start = -1
+            self._stack.append(ch)
+            if len(self._stack) == 1:
+                self._expect_key = True
+        elif ch in '}]':
+            if self._in_target_array() and self._item_start >= 0:
+                # 数字, 布尔等字面量元素以 ] 结束
+                self._emit(pos, items)
+            if self._stack:
+                self._stack.pop()
+            if self._in_target_array() and self._item_start >= 0:
+                # 对象或数组元素在其括号闭合时取出
+                self._emit(pos + 1, items)
+            if len(self._stack) <= 1:
+                self._field = None
+        elif ch == ',':
+            if self._in_target_array() and self._item_start >= 0:
+                self._emit(pos, items)
+            if len(self._stack) == 1:
+                self._expect_key = True
+        elif ch == ':':
+            if len(self._stack) == 1:
+                self._expect_key = False
+        elif not ch.isspace():
+            if self._in_target_array() and self._item_start < 0:
+                self._item_start = pos
@@ -1,15 +1,269 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Optional
+
+import openai
+from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import BaseMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
 from langchain_openai import ChatOpenAI
+from pydantic import BaseModel, ValidationError
+from tenacity import Retrying, stop_after_attempt, wait_random_exponential, retry_if_exception_type
 
 from util.config import config
+from util.json_stream import JsonArrayStreamParser
 from util.log import logger
+from util.metrics import latency
+from util.recording import Recorder, to_openai_messages
+from util.tracing import tracer
+
+# 可重试的瞬时错误: 网络, 限流, 服务端错误, 超时以及模型偶尔返回的无法解析的输出
+TRANSIENT_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    OutputParserException,
+    ValidationError,
+    TimeoutError,
+)
+
 
+DEFAULT_PROFILE = "default"
 
-def get_chat_model():
-    logger.info(f"初始化大模型 {config['ai']['model']}")
+
+def get_chat_model(profile: str = DEFAULT_PROFILE):
+    """
+    按模型配置创建大模型客户端, 配置中未填写的项使用 ai 下的默认值
+    :param profile: ai.profiles 中的配置名, default 为 ai 下的默认配置
+    """
+    ai = config['ai']
+    settings = {} if profile == DEFAULT_PROFILE else ai.get('profiles', {})[profile]
+    model = settings.get('model') or ai['model']
+    logger.info(f"初始化大模型 {model} ({profile})")
+    temperature = settings.get('temperature', ai.get('temperature'))
     return ChatOpenAI(
-        model=config['ai']['model'],
-        api_key=config['ai']['openai_api_key'].strip(),
-        base_url=config['ai']['openai_api_base'].strip()
+        model=model,
+        api_key=(settings.get('openai_api_key') or ai['openai_api_key']).strip(),
+        base_url=(settings.get('openai_api_base') or ai['openai_api_base']).strip(),
+        temperature=float(temperature) if temperature is not None else None,
+        timeout=float(settings.get('timeout', ai.get('timeout', 60))),
+        # 重试由 invoke_structured 统一处理
+        max_retries=0
     )
 
-llm = get_chat_model()
\ No newline at end of file
+
+_models: dict[str, ChatOpenAI] = {}
+_models_lock = threading.Lock()
+
+
+def get_profile_model(profile: str) -> ChatOpenAI:
+    with _models_lock:
+        if profile not in _models:
+            _models[profile] = get_chat_model(profile)
+        return _models[profile]
+
+
+def route_profile(handler_type: type, attempt: int = 0) -> str:
+    """
+    根据 ai.routing 选择处理器在第几次尝试时使用的模型配置
+    路由表按处理器类名匹配 (包括父类), 列表按尝试次数取用, 超出长度时使用最后一个
+    :param handler_type: 处理器类
+    :param attempt: 尝试次数, 0 为首次作答
+    :return: 模型配置名
+    """
+    routing = config['ai'].get('routing') or {}
+    profiles = routing.get('default', DEFAULT_PROFILE)
+    for cls in handler_type.__mro__:
+        if cls.__name__ in routing:
+            profiles = routing[cls.__name__]
+            break
+    if isinstance(profiles, str):
+        profiles = [profiles]
+    return profiles[min(attempt, len(profiles) - 1)]
+
+
+def validate_routing():
+    """
+    启动时检查 ai.routing 与对冲配置引用的模型配置都存在, 重试升级的配置与前一个使用相同模型时给出提示
+    """
+    ai = config['ai']
+    profiles = ai.get('profiles') or {}
+    routing = ai.get('routing') or {}
+    references = {f"ai.routing.{name}": [entry] if isinstance(entry, str) else list(entry)
+                  for name, entry in routing.items()}
+    if ai.get('resilience', {}).get('hedge_profile'):
+        references['ai.resilience.hedge_profile'] = [ai['resilience']['hedge_profile']]
+    for key, names in references.items():
+        unknown = [name for name in names if name != DEFAULT_PROFILE and name not in profiles]
+        if unknown:
+            raise ValueError(f"{key} 引用了不存在的模型配置 {unknown}, 可用的配置: "
+                             f"{[DEFAULT_PROFILE] + list(profiles)}")
+        models = [(profiles.get(name) or {}).get('model') or ai['model'] for name in names]
+        for previous, current, name in zip(models, models[1:], names[1:]):
+            if previous == current:
+                logger.warning(f"{key} 重试时使用的 {name} 与前一次是同一个模型 {current}, 不会升级到更强的模型")
+
+
+validate_routing()
+llm = get_profile_model(DEFAULT_PROFILE)
+
+_resilience = config['ai'].get('resilience', {})
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm")
+# 录制模式: 保存每次结构化输出的请求与响应, 供 util.llm_server 离线回放
+_recorder = Recorder(config['ai']['record']) if config['ai'].get('record') else None
+
+
+def count_tokens(messages: list[BaseMessage], profile: str = DEFAULT_PROFILE) -> int:
+    """
+    用该模型配置的分词器估算消息的 token 数, 无法加载分词器时按字符数粗略估算
+    """
+    try:
+        model = get_profile_model(profile)
+        return sum(model.get_num_tokens(str(message.content)) + 4 for message in messages)
+    except Exception as e:
+        logger.debug(f"分词器不可用, 按字符数估算 token: {e}")
+        return sum(len(str(message.content)) // 3 + 4 for message in messages)
+
+
+def invoke_structured(messages: list[BaseMessage], schema: type[BaseModel],
+                      on_item: Optional[Callable[[str, int, Any], None]] = None,
+                      profile: str = DEFAULT_PROFILE) -> BaseModel:
+    """
+    调用大模型并返回结构化输出, 带有截止时间, 随机抖动的指数退避重试与可选的对冲请求
+    :param messages: 对话消息
+    :param schema: 输出结构
+    :param on_item: 数组字段元素回调 (字段名, 元素序号, 元素值), 开启流式输出时每解析完一个元素立即回调,
+                    否则在完整响应返回后依次回调
+    :param profile: 使用的模型配置名
+    :return: 结构化输出
+    """
+    retrying = Retrying(
+        stop=stop_after_attempt(int(_resilience.get('attempts', 3))),
+        wait=wait_random_exponential(multiplier=float(_resilience.get('wait_min', 1)),
+                                     max=float(_resilience.get('wait_max', 30))),
+        retry=retry_if_exception_type(TRANSIENT_ERRORS),
+        before_sleep=lambda state: logger.warning(
+            f"大模型调用失败, 第{state.attempt_number}次重试: {state.outcome.exception()}"),
+        reraise=True
+    )
+    started = time.monotonic()
+    response = retrying(_invoke_hedged, messages, schema, on_item, profile)
+    if _recorder is not None:
+        tool = convert_to_openai_tool(schema)['function']
+        _recorder.record(tool['name'], tool['parameters'], to_openai_messages(messages),
+                         response.model_dump_json(), time.monotonic() - started)
+    return response
+
+
+def _invoke_hedged(messages: list[BaseMessage], schema: type[BaseModel],
+                   on_item: Optional[Callable[[str, int, Any], None]], profile: str) -> BaseModel:
+    """
+    在截止时间内等待请求结果, 超过对冲阈值仍未响应时向对冲端点再发送一份相同的请求, 取先完成者
+    流式输出时先回调出元素的请求获得回调权, 另一请求的结果将被丢弃
+    返回或抛出异常后仍在运行的请求不再回调, 避免超时重试后旧请求继续填写页面
+    """
+    deadline = float(_resilience.get('deadline', 180))
+    started = time.monotonic()
+    owner = []
+    closed = threading.Event()
+    lock = threading.Lock()
+
+    def attempt(model: ChatOpenAI, name: str) -> BaseModel:
+        def guarded(field: str, index: int, item: Any):
+            with lock:
+                if closed.is_set():
+                    return
+                if not owner:
+                    owner.append(name)
+                if owner[0] == name:
+                    on_item(field, index, item)
+
+        return _invoke(model, messages, schema, guarded if on_item else None)
+
+    futures = {_executor.submit(tracer.carry(attempt), get_profile_model(profile), "primary"): "primary"}
+    try:
+        return _await_hedged(futures, attempt, owner, profile, started, deadline)
+    finally:
+        with lock:
+            closed.set()
+        for future in futures:
+            future.cancel()
+
+
+def _await_hedged(futures: dict, attempt: Callable, owner: list, profile: str, started: float,
+                  deadline: float) -> BaseModel:
+    """
+    等待主请求与对冲请求中先完成者
+    """
+    hedge_after = float(_resilience.get('hedge_after', 0))
+    pending = set(futures)
+    if hedge_after > 0:
+        done, pending = wait(pending, timeout=min(hedge_after, deadline))
+        if not done and not owner:
+            hedge_profile = _resilience.get('hedge_profile') or profile
+            logger.info(f"大模型超过{hedge_after}秒未响应, 向 {hedge_profile} 发送对冲请求")
+            hedged = _executor.submit(tracer.carry(attempt), get_profile_model(hedge_profile), "hedge")
+            futures[hedged] = "hedge"
+            pending.add(hedged)
+        pending |= done
+
+    error = None
+    while pending:
+        remaining = deadline - (time.monotonic() - started)
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = futures[future]
+            if owner and owner[0] != name:
+                continue
+            if future.exception() is not None:
+                error = future.exception()
+                if owner:
+                    raise error
+                continue
+            elapsed = time.monotonic() - started
+            latency.record("llm", elapsed)
+            latency.record(f"llm.{profile}.{name}", elapsed)
+            return future.result()
+
+    if error is not None and not pending:
+        raise error
+    latency.record("llm.timeout", deadline)
+    raise TimeoutError(f"大模型调用超过{deadline}秒未完成")
+
+
+def _invoke(model: ChatOpenAI, messages: list[BaseMessage], schema: type[BaseModel],
+            on_item: Optional[Callable[[str, int, Any], None]]) -> BaseModel:
+    if on_item and config['ai'].get('streaming', False):
+        with tracer.span("llm.stream", schema=schema.__name__, model=model.model_name):
+            return _stream_structured(model, messages, schema, on_item)
+
+    with tracer.span("llm.invoke", schema=schema.__name__, model=model.model_name):
+        response = model.with_structured_output(schema).invoke(messages)
+    if on_item:
+        replay_items(response, on_item)
+    return response
+
+
+def replay_items(response: BaseModel, on_item: Callable[[str, int, Any], None]):
+    """
+    对完整的结构化输出依次回调数组字段中的每个元素
+    """
+    for field, value in response.model_dump().items():
+        if isinstance(value, list):
+            for index, item in enumerate(value):
+                on_item(field, index, item)
+
+
+def _stream_structured(model: ChatOpenAI, messages: list[BaseMessage], schema: type[BaseModel],
+                       on_item: Callable[[str, int, Any], None]) -> BaseModel:
+    parser = JsonArrayStreamParser()
+    bound = model.bind_tools([schema], tool_choice=schema.__name__)
+    for chunk in bound.stream(messages):
+        for tool_chunk in chunk.tool_call_chunks:
+            for field, index, item in parser.feed(tool_chunk.get('args') or ''):
+                on_item(field, index, item)
+    return schema.model_validate_json(parser.text)
@@ -0,0 +1,198 @@
+import argparse
+import json
+import random
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Callable
+
+from util.log import logger
+from util.recording import request_key, load_recordings
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """
+    解析延迟分布
+    支持 fixed:秒, uniform:最小,最大, normal:均值,标准差, lognormal:mu,sigma, exp:均值
+    """
+    name, _, params = spec.partition(':')
+    values = [float(value) for value in params.split(',') if value]
+    samplers = {
+        'fixed': lambda: values[0],
+        'uniform': lambda: random.uniform(values[0], values[1]),
+        'normal': lambda: random.gauss(values[0], values[1]),
+        'lognormal': lambda: random.lognormvariate(values[0], values[1]),
+        'exp': lambda: random.expovariate(1 / values[0]),
+    }
+    if name not in samplers:
+        raise ValueError(f"不支持的延迟分布: {spec}")
+    sampler = samplers[name]
+    return lambda: max(0.0, sampler())
+
+
+def synthesize(schema: dict, array_size: int, defs: dict = None) -> Any:
+    """
+    按 JSON Schema 生成一个合法的示例值
+    """
+    defs = defs if defs is not None else schema.get('$defs', schema.get('definitions', {}))
+    if '$ref' in schema:
+        return synthesize(defs[schema['$ref'].split('/')[-1]], array_size, defs)
+    if 'enum' in schema:
+        return schema['enum'][0]
+    for key in ('anyOf', 'oneOf', 'allOf'):
+        if key in schema:
+            options = [option for option in schema[key] if option.get('type') != 'null'] or schema[key]
+            return synthesize(options[0], array_size, defs)
+    schema_type = schema.get('type', 'object')
+    if isinstance(schema_type, list):
+        schema_type = next((item for item in schema_type if item != 'null'), 'null')
+    if schema_type == 'object':
+        return {name: synthesize(prop, array_size, defs) for name, prop in schema.get('properties', {}).items()}
+    if schema_type == 'array':
+        return [synthesize(schema.get('items', {}), array_size, defs) for _ in range(array_size)]
+    if schema_type == 'integer':
+        return 0
+    if schema_type == 'number':
+        return 0.0
+    if schema_type == 'boolean':
+        return False
+    if schema_type == 'null':
+        return None
+    return "A"
+
+
+def _content_text(content) -> str:
+    if isinstance(content, list):
+        return ''.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return content or ''
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """
+    兼容 OpenAI 接口的本地替身, 只实现带工具调用的 /chat/completions
+    """
+    recordings: dict[str, dict] = {}
+    latency: Callable[[], float] = staticmethod(lambda: 0.0)
+    chunk_delay: float = 0.0
+    chunk_size: int = 16
+    array_size: int = 4
+    stats = {'replayed': 0, 'synthesized': 0}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_error(404)
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        tool_name, arguments = self._answer(body)
+        time.sleep(self.latency())
+        if body.get('stream'):
+            self._stream(body, tool_name, arguments)
+        else:
+            time.sleep(self.chunk_delay * (len(arguments) // self.chunk_size + 1))
+            self._send_json(self._completion(body, tool_name, arguments))
+
+    def _answer(self, body: dict) -> tuple[str, str]:
+        tools = body.get('tools') or []
+        choice = body.get('tool_choice')
+        name = choice['function']['name'] if isinstance(choice, dict) else None
+        tool = next((tool['function'] for tool in tools if tool['function']['name'] == name),
+                    tools[0]['function'] if tools else {'name': name or 'answer', 'parameters': {}})
+        messages = [{'role': message['role'], 'content': _content_text(message.get('content'))}
+                    for message in body.get('messages', [])]
+        recording = self.recordings.get(request_key(tool['name'], messages))
+        if recording:
+            self.stats['replayed'] += 1
+            return tool['name'], recording['arguments']
+        self.stats['synthesized'] += 1
+        arguments = synthesize(tool.get('parameters', {}), self.array_size)
+        return tool['name'], json.dumps(arguments, ensure_ascii=False)
+
+    def _completion(self, body: dict, tool_name: str, arguments: str) -> dict:
+        return {
+            'id': f"chatcmpl-{uuid.uuid4().hex}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'message': {
+                    'role': 'assistant',
+                    'content': None,
+                    'tool_calls': [{
+                        'id': 'call_0',
+                        'type': 'function',
+                        'function': {'name': tool_name, 'arguments': arguments}
+                    }]
+                },
+                'finish_reason': 'tool_calls'
+            }],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+        }
+
+    def _stream(self, body: dict, tool_name: str, arguments: str):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        base = {
+            'id': f"chatcmpl-{uuid.uuid4().hex}",
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': body.get('model', 'fake')
+        }
+
+        def send(delta: dict, finish_reason=None):
+            chunk = dict(base, choices=[{'index': 0, 'delta': delta, 'finish_reason': finish_reason}])
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        send({'role': 'assistant', 'content': None, 'tool_calls': [{
+            'index': 0, 'id': 'call_0', 'type': 'function', 'function': {'name': tool_name, 'arguments': ''}
+        }]})
+        for start in range(0, len(arguments), self.chunk_size):
+            time.sleep(self.chunk_delay)
+            send({'tool_calls': [{'index': 0, 'function': {'arguments': arguments[start:start + self.chunk_size]}}]})
+        send({}, 'tool_calls')
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_json(self, payload: dict):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容替身服务, 回放录制的大模型响应或生成符合结构的合成答案")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--recordings', default='recordings/llm.jsonl', help="ai.record 录制的文件")
+    parser.add_argument('--latency', default='fixed:0', help="首个响应前的延迟分布, 如 lognormal:0.5,0.4")
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help="流式输出每个分片之间的延迟(秒)")
+    parser.add_argument('--chunk-size', type=int, default=16, help="流式输出每个分片的字符数")
+    parser.add_argument('--array-size', type=int, default=4, help="合成答案中数组的长度")
+    args = parser.parse_args()
+
+    FakeOpenAIHandler.recordings = load_recordings(args.recordings)
+    FakeOpenAIHandler.latency = staticmethod(parse_latency(args.latency))
+    FakeOpenAIHandler.chunk_delay = args.chunk_delay
+    FakeOpenAIHandler.chunk_size = args.chunk_size
+    FakeOpenAIHandler.array_size = args.array_size
+
+    server = ThreadingHTTPServer((args.host, args.port), FakeOpenAIHandler)
+    logger.info(f"已加载{len(FakeOpenAIHandler.recordings)}条录制, 监听 http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info(f"回放{FakeOpenAIHandler.stats['replayed']}次, 合成{FakeOpenAIHandler.stats['synthesized']}次")
+
+
+if __name__ == '__main__':
+    main()
@@ -14,7 +14,7 @@ def setup_logger():
 
     logging.basicConfig(
         level=config['logging']['level'],
-        format='%(asctime)s - %(levelname)s - %(message)s',
+        format='%(asctime)s - %(threadName)s - %(levelname)s - %(message)s',
         handlers=[
             logging.FileHandler(file),
             logging.StreamHandler()
@@ -0,0 +1,60 @@
+import threading
+from collections import defaultdict, deque
+
+
+class LatencyRecorder:
+    """
+    耗时记录器, 按名称保存最近的耗时样本并计算尾部延迟分位数
+    """
+
+    def __init__(self, max_samples: int = 1000):
+        self._samples: dict[str, deque] = defaultdict(lambda: deque(maxlen=max_samples))
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self._samples[name].append(seconds)
+
+    def percentiles(self, name: str, points: tuple[int, ...] = (50, 90, 99)) -> dict[int, float]:
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if not samples:
+            return {}
+        return {point: samples[min(len(samples) - 1, int(len(samples) * point / 100))] for point in points}
+
+    def summary(self) -> str:
+        with self._lock:
+            names = sorted(self._samples)
+        lines = []
+        for name in names:
+            count = len(self._samples[name])
+            stats = ', '.join(f"p{point}={value:.2f}s" for point, value in self.percentiles(name).items())
+            lines.append(f"{name}: {count}次, {stats}")
+        return '\n'.join(lines)
+
+
+class TokenRecorder:
+    """
+    提示词 token 统计, 按名称累计调用次数, 总量与最大值
+    """
+
+    def __init__(self):
+        self._stats: dict[str, list[int]] = defaultdict(lambda: [0, 0, 0])
+        self._lock = threading.Lock()
+
+    def record(self, name: str, tokens: int):
+        with self._lock:
+            stats = self._stats[name]
+            stats[0] += 1
+            stats[1] += tokens
+            stats[2] = max(stats[2], tokens)
+
+    def summary(self) -> str:
+        with self._lock:
+            items = sorted(self._stats.items())
+        return '\n'.join(f"{name}: {count}次, 共{total} tokens, 平均{total // count}, 最大{largest}"
+                         for name, (count, total, largest) in items)
+
+
+latency = LatencyRecorder()
+prompt_tokens = TokenRecorder()
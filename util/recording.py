@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+import threading
+
+# langchain 消息类型 -> OpenAI 接口中的角色
+_ROLES = {'human': 'user', 'ai': 'assistant', 'system': 'system', 'tool': 'tool'}
+
+
+def request_key(tool_name: str, messages: list[dict]) -> str:
+    """
+    根据工具名与消息的角色和内容计算请求的唯一键, 录制与回放使用同一算法
+    :param tool_name: 结构化输出使用的工具名 (即输出结构的类名)
+    :param messages: [{"role": 角色, "content": 内容}]
+    """
+    payload = json.dumps(
+        [tool_name, [[message['role'], message['content']] for message in messages]],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def to_openai_messages(messages) -> list[dict]:
+    return [{'role': _ROLES.get(message.type, message.type), 'content': str(message.content)}
+            for message in messages]
+
+
+class Recorder:
+    """
+    把结构化输出的请求与响应逐行追加到 JSONL 文件
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def record(self, tool_name: str, parameters: dict, messages: list[dict], arguments: str, elapsed: float):
+        line = json.dumps({
+            'key': request_key(tool_name, messages),
+            'tool': tool_name,
+            'parameters': parameters,
+            'messages': messages,
+            'arguments': arguments,
+            'elapsed': round(elapsed, 3)
+        }, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(line + '\n')
+
+
+def load_recordings(path: str) -> dict[str, dict]:
+    """
+    读取录制文件, 同一请求录制多次时以最后一次为准
+    :return: 请求键 -> 录制内容
+    """
+    recordings = {}
+    if not os.path.exists(path):
+        return recordings
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                item = json.loads(line)
+                recordings[item['key']] = item
+    return recordings
@@ -1,7 +1,12 @@
+import os
+import sys
+import time
 from typing import Optional
 
+import urllib3
 from bs4 import BeautifulSoup
 from selenium import webdriver
+from selenium.common import WebDriverException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.remote.webelement import WebElement
 from selenium.webdriver.support import expected_conditions as EC
@@ -10,6 +15,11 @@ from webdriver_manager.chrome import ChromeDriverManager
 
 from util.config import config
 from util.log import logger
+from util.metrics import latency
+from util.tracing import tracer
+
+# 浏览器会话断开时可能抛出的异常, chromedriver 进程退出时 Selenium 抛出的是 urllib3 的连接错误
+SESSION_ERRORS = (WebDriverException, urllib3.exceptions.HTTPError, ConnectionError)
 
 
 def get_parent_element(driver, child_element) -> WebElement:
@@ -21,6 +31,16 @@ def get_pure_text(element: WebElement) -> str:
     return soup.get_text(separator="\n")
 
 
+def get_pure_texts(driver, selector: str) -> list[str]:
+    """
+    一次脚本调用读取所有匹配元素的纯文本, 与 get_pure_text 的结果一致
+    """
+    htmls = driver.execute_script(
+        "return Array.from(document.querySelectorAll(arguments[0])).map(element => element.outerHTML);", selector)
+    return [BeautifulSoup(html, 'lxml').get_text(separator="\n") for html in htmls]
+
+
+@tracer.traced("click")
 def click_button(driver, selector, wait_time=30):
     from selenium.common import TimeoutException
     try:
@@ -32,19 +52,313 @@ def click_button(driver, selector, wait_time=30):
     except TimeoutException:
         pass
 
-def find_element_safely(driver, value: Optional[str] = None) -> Optional[WebElement]:
-    from selenium.common import NoSuchElementException
+def _call_site(depth: int) -> str:
+    frame = sys._getframe(depth + 1)
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+
+
+def find_all(context, selector: str, timeout: float = 0.0, site: Optional[str] = None) -> list[WebElement]:
+    """
+    按CSS选择器查找元素, 不依赖隐式等待
+    :param context: 驱动器或元素
+    :param selector: CSS选择器
+    :param timeout: 最长等待时间(秒), 为0时只查找一次
+    :param site: 调用位置, 用于统计等待耗时, 默认为调用方的函数名
+    :return: 找到的元素, 超时返回空列表
+    """
+    from selenium.common import TimeoutException
+    start = time.perf_counter()
+    elements = context.find_elements(By.CSS_SELECTOR, selector)
+    if not elements and timeout > 0:
+        try:
+            with tracer.span("wait.find", selector=selector):
+                elements = WebDriverWait(context, timeout, poll_frequency=0.1).until(
+                    lambda _: context.find_elements(By.CSS_SELECTOR, selector)
+                )
+        except TimeoutException:
+            elements = []
+    if timeout > 0 or not elements:
+        # 只统计发生等待或元素不存在的调用, 元素不存在时的耗时单独记录
+        name = site or _call_site(1)
+        latency.record(f"find.{name}" if elements else f"find.miss.{name}", time.perf_counter() - start)
+    return elements
+
+
+def find(context, selector: str, timeout: float = 0.0, site: Optional[str] = None) -> Optional[WebElement]:
+    """
+    按CSS选择器查找第一个元素, 不依赖隐式等待
+    :return: 找到的元素, 超时返回 None
+    """
+    elements = find_all(context, selector, timeout, site or _call_site(1))
+    return elements[0] if elements else None
+
+
+def find_text(context, selector: str, timeout: float = 0.0, default: str = '') -> str:
+    """
+    查找第一个元素并返回其文本, 超时返回 default
+    """
+    element = find(context, selector, timeout, _call_site(1))
+    return element.text if element is not None else default
+
+
+def find_element_safely(driver, value: Optional[str] = None, timeout: float = 0.0) -> Optional[WebElement]:
+    return find(driver, value, timeout, _call_site(1))
+
+# 判断题目对错: 只检查题目元素自身及其子元素 (不含嵌套的其他题目), 类名与标记完全一致才算匹配,
+# 有错误标记则为错, 有正确标记则为对, 都没有返回 null
+_RESULT_FLAGS_SCRIPT = """
+const [selector, correct, wrong] = arguments;
+const questions = Array.from(document.querySelectorAll(selector));
+const has = (node, marks) => Array.from(node.classList).some(name => marks.includes(name.toLowerCase()));
+return questions.map(element => {
+    const scope = [element, ...Array.from(element.querySelectorAll('*')).filter(node =>
+        !questions.some(other => other !== element && element.contains(other) && other.contains(node)))];
+    if (scope.some(node => has(node, wrong))) return false;
+    if (scope.some(node => has(node, correct))) return true;
+    return null;
+});
+"""
+
+
+def get_result_flags(driver, selector: str) -> list[Optional[bool]]:
+    """
+    提交后一次脚本调用读取每道题的对错
+    :param driver: 驱动器
+    :param selector: 题目元素的选择器
+    :return: 按页面顺序的对错列表, 无法判断的题目为 None
+    """
+    result = config['unipus'].get('result', {})
+    return driver.execute_script(
+        _RESULT_FLAGS_SCRIPT,
+        selector,
+        [mark.lower() for mark in result.get('correct_classes', ['correct', 'right', 'is-correct', 'is-right'])],
+        [mark.lower() for mark in result.get('wrong_classes', ['wrong', 'error', 'incorrect', 'is-wrong', 'is-error'])]
+    )
+
+# 批量填写输入框: 使用原生 value setter 赋值后派发 input/change 事件, 使前端框架同步数据, 返回实际写入的内容
+# 已是目标内容的输入框不再写入; 等前端框架在下一帧重新渲染后再读取实际内容, 被框架改回的输入框校验不通过
+_FILL_SCRIPT = """
+const [elements, values] = arguments;
+const done = arguments[arguments.length - 1];
+elements.forEach((element, index) => {
+    if (element.value === values[index]) return;
+    const proto = element instanceof HTMLTextAreaElement ? HTMLTextAreaElement.prototype : HTMLInputElement.prototype;
+    Object.getOwnPropertyDescriptor(proto, 'value').set.call(element, values[index]);
+    element.dispatchEvent(new Event('input', {bubbles: true}));
+    element.dispatchEvent(new Event('change', {bubbles: true}));
+});
+let finished = false;
+const finish = () => {
+    if (finished) return;
+    finished = true;
+    done(elements.map(element => element.value));
+};
+// 后台标签页中 requestAnimationFrame 可能不触发, 用定时器兜底
+requestAnimationFrame(() => setTimeout(finish, 0));
+setTimeout(finish, 200);
+"""
+
+
+@tracer.traced("fill.values")
+def fill_values(driver, elements: list[WebElement], values: list[str]) -> list[str]:
+    """
+    一次脚本调用填写多个 input/textarea, 已是目标内容的输入框跳过
+    :param driver: 驱动器
+    :param elements: 输入框
+    :param values: 与输入框一一对应的内容
+    :return: 前端重新渲染后每个输入框的实际内容, 用于校验
+    """
+    return driver.execute_async_script(_FILL_SCRIPT, elements, [str(value) for value in values])
+
+# 等待页面稳定: 首次调用时在页面中安装 MutationObserver 与 XHR/fetch 计数,
+# 文档加载完成, 没有进行中的请求且 DOM 在 quiet 毫秒内没有变化即视为稳定, 超过 timeout 毫秒返回 false
+_SETTLE_SCRIPT = """
+const [quiet, timeout] = arguments;
+const done = arguments[arguments.length - 1];
+let state = window.__autoUnipusWait;
+if (!state) {
+    state = window.__autoUnipusWait = {pending: 0, last: performance.now()};
+    const touch = () => state.last = performance.now();
+    new MutationObserver(touch).observe(document.documentElement,
+        {subtree: true, childList: true, attributes: true, characterData: true});
+    const send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function (...args) {
+        state.pending++;
+        touch();
+        this.addEventListener('loadend', () => { state.pending--; touch(); }, {once: true});
+        return send.apply(this, args);
+    };
+    if (window.fetch) {
+        const fetch = window.fetch;
+        window.fetch = function (...args) {
+            state.pending++;
+            touch();
+            return fetch.apply(this, args).finally(() => { state.pending--; touch(); });
+        };
+    }
+}
+const start = performance.now();
+const check = () => {
+    const now = performance.now();
+    const settled = document.readyState === 'complete' && state.pending <= 0 && now - state.last >= quiet;
+    if (settled || now - start >= timeout) {
+        done(settled);
+    } else {
+        setTimeout(check, 50);
+    }
+};
+check();
+"""
+
+
+@tracer.traced("wait.settle")
+def wait_for_settled(driver, timeout: Optional[float] = None, min_delay: float = 0.0) -> bool:
+    """
+    等待页面稳定, 页面稳定后立即返回, 代替固定时长的等待
+    :param driver: 驱动器
+    :param timeout: 最长等待时间(秒), 默认为 selenium.wait.timeout
+    :param min_delay: 最短等待时间(秒), 与 selenium.wait.min_delay 取较大者
+    :return: 是否在超时前稳定
+    """
+    wait_config = config['selenium'].get('wait', {})
+    if timeout is None:
+        timeout = float(wait_config.get('timeout', 5))
+    min_delay = max(min_delay, float(wait_config.get('min_delay', 0)))
+    start = time.perf_counter()
     try:
-        return driver.find_element(By.CSS_SELECTOR, value)
-    except NoSuchElementException:
-        return None
+        settled = bool(driver.execute_async_script(
+            _SETTLE_SCRIPT, float(wait_config.get('quiet', 0.3)) * 1000, timeout * 1000))
+    except WebDriverException as e:
+        # 等待期间发生跳转等情况时脚本会中断, 视为未稳定
+        logger.debug(f"等待页面稳定失败: {e}")
+        settled = False
+    remaining = min_delay - (time.perf_counter() - start)
+    if remaining > 0:
+        with tracer.span("sleep", seconds=round(remaining, 3)):
+            time.sleep(remaining)
+    latency.record("wait.settle", time.perf_counter() - start)
+    return settled
 
-def get_driver():
+def _performance_profile() -> dict:
+    return config['selenium'].get('performance', {})
+
+
+def _apply_performance_options(options, profile: dict):
+    """
+    精简浏览器配置: 关闭图片, GPU与扩展, 使用 eager 加载策略 (DOM 就绪即返回, 不等待图片等资源)
+    """
+    if profile.get('block_images', True):
+        options.add_argument('--blink-settings=imagesEnabled=false')
+        options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+    options.add_argument('--disable-gpu')
+    options.add_argument('--disable-extensions')
+    options.page_load_strategy = profile.get('page_load_strategy', 'eager')
+
+
+def _block_urls(driver, profile: dict):
+    """
+    通过 CDP 屏蔽处理器用不到的资源, 音视频与接口请求不在列表中, 不受影响
+    """
+    urls = profile.get('blocked_urls', [])
+    if not urls:
+        return
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': urls})
+    logger.info(f"已屏蔽{len(urls)}类资源请求")
+
+
+_NAVIGATION_TIMING_SCRIPT = """
+const entry = performance.getEntriesByType('navigation')[0];
+return entry ? [entry.domContentLoadedEventEnd, entry.loadEventEnd] : null;
+"""
+
+
+def record_navigation(name: str, start: float) -> float:
+    """
+    记录一次跳转的耗时, 按是否启用精简配置分别统计, 便于对比
+    :param name: 跳转类型, 如 page_load, navigate.tab
+    :param start: 开始跳转时的 time.perf_counter()
+    :return: 耗时(秒)
+    """
+    elapsed = time.perf_counter() - start
+    latency.record(f"{name}.lean" if _performance_profile().get('enabled') else f"{name}.default", elapsed)
+    return elapsed
+
+
+def open_page(driver, url: str):
+    """
+    打开页面并记录加载耗时
+    """
+    start = time.perf_counter()
+    driver.get(url)
+    elapsed = record_navigation("page_load", start)
+    timing = driver.execute_script(_NAVIGATION_TIMING_SCRIPT)
+    if timing:
+        logger.info(f"页面加载耗时{elapsed:.2f}秒 (DOMContentLoaded {timing[0] / 1000:.2f}秒, "
+                    f"load {timing[1] / 1000:.2f}秒): {url}")
+    else:
+        logger.info(f"页面加载耗时{elapsed:.2f}秒: {url}")
+
+
+def is_session_alive(driver) -> bool:
+    """
+    浏览器会话是否仍然可用, 检查时出现任何异常都视为已断开
+    """
+    try:
+        driver.execute_script("return 1;")
+        return True
+    except Exception as e:
+        logger.debug(f"浏览器会话不可用: {e}")
+        return False
+
+
+def _resolve_driver_path(refresh: bool = False) -> str:
+    """
+    获取 chromedriver 路径, 优先使用配置的路径与上次下载的缓存, 避免每次启动都联网检查版本
+    :param refresh: 忽略缓存重新检查
+    """
+    driver_path = config['selenium'].get('driver_path')
+    if driver_path:
+        return driver_path
+    cache_file = config['selenium'].get('driver_cache', '.cache/chromedriver_path')
+    if not refresh and os.path.exists(cache_file):
+        with open(cache_file, 'r', encoding='utf-8') as file:
+            cached_path = file.read().strip()
+        if cached_path and os.path.exists(cached_path):
+            return cached_path
+    driver_path = ChromeDriverManager().install()
+    directory = os.path.dirname(cache_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(cache_file, 'w', encoding='utf-8') as file:
+        file.write(driver_path)
+    return driver_path
+
+
+def get_driver(persistent: bool = True):
+    """
+    :param persistent: 是否使用 selenium.user_data_dir, 同一个用户数据目录只能被一个浏览器使用
+    """
+    from selenium.common import SessionNotCreatedException
+    from selenium.webdriver.chrome.service import Service
     options = webdriver.ChromeOptions()
     if config['selenium']['headless']:
         options.add_argument('--headless')
-    from selenium.webdriver.chrome.service import Service
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
-    driver.implicitly_wait(config['selenium']['implicit_wait'])
+    profile = _performance_profile()
+    if profile.get('enabled'):
+        _apply_performance_options(options, profile)
+    if persistent and (user_data_dir := config['selenium'].get('user_data_dir')):
+        # 复用浏览器用户数据, 保留登录会话
+        options.add_argument(f"--user-data-dir={os.path.abspath(user_data_dir)}")
+    try:
+        driver = webdriver.Chrome(service=Service(_resolve_driver_path()), options=options)
+    except SessionNotCreatedException as e:
+        # 浏览器升级后缓存的 chromedriver 版本不匹配, 重新检查
+        logger.warning(f"chromedriver 与浏览器版本不匹配, 重新获取: {e.msg}")
+        driver = webdriver.Chrome(service=Service(_resolve_driver_path(refresh=True)), options=options)
+    # 不使用隐式等待, 需要等待的查找由调用方显式指定超时
+    driver.implicitly_wait(0)
+    if profile.get('enabled'):
+        _block_urls(driver, profile)
     logger.info("启动浏览器")
     return driver
\ No newline at end of file
@@ -0,0 +1,169 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Optional
+
+from util.config import config
+from util.log import logger
+
+# 未开启追踪时 span 返回的空上下文, 可重复使用
+_NULL_SPAN = nullcontext()
+
+
+class Tracer:
+    """
+    轻量的耗时追踪, 记录每段操作的开始时间与耗时并归到当前任务
+    导出为 Chrome trace-event 格式 (chrome://tracing 或 Perfetto 打开) 与按任务汇总的 JSON
+    未开启时 span 返回空上下文, traced 直接返回原函数
+    """
+
+    def __init__(self, settings: dict):
+        self.enabled = bool(settings.get('enabled', False))
+        self.path = settings.get('path', 'logs/trace.json')
+        self.summary_path = settings.get('summary', 'logs/trace_summary.json')
+        self._events: list[dict] = []
+        self._threads: dict[int, str] = {}
+        # 任务 -> 名称 -> [次数, 总耗时]
+        self._tasks: dict[str, dict[str, list]] = defaultdict(lambda: defaultdict(lambda: [0, 0.0]))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        if self.enabled:
+            atexit.register(self.export)
+
+    @property
+    def current_task(self) -> Optional[str]:
+        return getattr(self._local, 'task', None)
+
+    def span(self, name: str, **args):
+        """
+        记录一段操作的耗时
+        :param name: 名称, 以 . 分隔类别, 如 fill.values
+        :param args: 附加在事件上的参数
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name, args)
+
+    @contextmanager
+    def _span(self, name: str, args: dict):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, start, time.perf_counter() - start, args)
+
+    def traced(self, name: str) -> Callable:
+        """
+        把整个函数作为一段操作记录的装饰器
+        """
+
+        def decorator(func):
+            if not self.enabled:
+                return func
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self._span(name, {}):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    @contextmanager
+    def task(self, label: str):
+        """
+        在当前线程中把之后的操作归到该任务, 任务本身也记录为一段操作
+        """
+        if not self.enabled:
+            yield
+            return
+        previous = self.current_task
+        self._local.task = label
+        try:
+            with self._span("task", {'task': label}):
+                yield
+        finally:
+            self._local.task = previous
+
+    def carry(self, func: Callable) -> Callable:
+        """
+        让提交到其他线程执行的函数沿用当前线程的任务
+        """
+        label = self.current_task
+        if not self.enabled or label is None:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            previous = self.current_task
+            self._local.task = label
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.task = previous
+
+        return wrapper
+
+    def _record(self, name: str, start: float, duration: float, args: dict):
+        thread = threading.current_thread()
+        task = self.current_task
+        event = {
+            'name': name,
+            'cat': name.split('.')[0],
+            'ph': 'X',
+            'ts': round((start - self._origin) * 1e6, 1),
+            'dur': round(duration * 1e6, 1),
+            'pid': os.getpid(),
+            'tid': thread.ident
+        }
+        if task is not None or args:
+            event['args'] = {'task': task, **{key: str(value) for key, value in args.items()}}
+        with self._lock:
+            self._events.append(event)
+            self._threads.setdefault(thread.ident, thread.name)
+            if task is not None:
+                stats = self._tasks[task][name]
+                stats[0] += 1
+                stats[1] += duration
+
+    def summary(self) -> dict:
+        """
+        按任务汇总各类操作的次数与耗时 (秒), 嵌套的操作同时计入外层
+        """
+        with self._lock:
+            result = {}
+            for task, names in self._tasks.items():
+                spans = {name: {'count': count, 'seconds': round(seconds, 3)}
+                         for name, (count, seconds) in sorted(names.items(), key=lambda item: -item[1][1])}
+                result[task] = {'total': spans.get('task', {}).get('seconds', 0.0), 'spans': spans}
+        return result
+
+    def export(self):
+        """
+        写出 Chrome trace-event 文件与按任务汇总的 JSON
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                    for tid, name in threads.items()]
+        for path, content in ((self.path, {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}),
+                              (self.summary_path, self.summary())):
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as file:
+                json.dump(content, file, ensure_ascii=False)
+        logger.info(f"追踪已导出{len(events)}段: {self.path}, 任务汇总: {self.summary_path}")
+
+
+tracer = Tracer(config['logging'].get('tracing', {}))